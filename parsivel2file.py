@@ -1,12 +1,760 @@
 #!/bin/python3
 import os
+import sys
+import io
+import glob
+import gzip
+import zlib
 import time
+import queue
+import socket
+import struct
+import pickle
+import threading
+import signal
+import argparse
+import multiprocessing
 
 import datetime
+import collections
 import serial
 
 import numpy as np
-import netCDF4 as nc
+
+
+def _netcdf4():
+    # netCDF4 takes a while to import, so only load it once we write nc files
+    import netCDF4
+    return netCDF4
+
+
+# COO representation of a spectrum: flat bin index and count of non-zero bins
+sparsespectrum = collections.namedtuple('sparsespectrum', ['index', 'count'])
+
+
+def todense(spectra, shape=(32, 32)):
+    """
+    Stack a list of dense and/or sparse spectra into one dense array.
+
+    Returns
+    -------
+    dense : array of float
+        Shape (len(spectra),) + shape.
+
+    """
+    nrecords = len(spectra)
+    issparse = [isinstance(i, sparsespectrum) for i in spectra]
+    if not any(issparse):
+        return np.asarray(spectra, dtype=float).reshape((nrecords,) + shape)
+
+    dense = np.zeros((nrecords, int(np.prod(shape))))
+    if all(issparse):
+        # scatter the whole batch at once
+        rows = np.repeat(np.arange(nrecords), [len(i.index) for i in spectra])
+        dense[rows, np.concatenate([i.index for i in spectra])] = \
+            np.concatenate([i.count for i in spectra])
+    else:
+        for record, spectrum in enumerate(spectra):
+            if isinstance(spectrum, sparsespectrum):
+                dense[record, spectrum.index] = spectrum.count
+            else:
+                dense[record] = np.ravel(spectrum)
+    return dense.reshape((nrecords,) + shape)
+
+
+def tosparse(dense):
+    """
+    Split a dense array of spectra (records first) into a list of sparsespectrum.
+    """
+    flat = np.reshape(dense, (len(dense), -1))
+    rows, index = np.nonzero(flat)
+    bounds = np.cumsum(np.bincount(rows, minlength=len(flat)))[:-1]
+    return [sparsespectrum(i.astype('i2'), c.astype('i4'))
+            for i, c in zip(np.split(index, bounds), np.split(flat[rows, index], bounds))]
+
+
+def toragged(spectra):
+    """
+    Convert a list of dense and/or sparse spectra to a contiguous ragged array.
+
+    Returns
+    -------
+    counts : array of int
+        Number of non-zero bins per record.
+    index : array of int
+        Flat bin index of every non-zero bin.
+    values : array
+        Value of every non-zero bin.
+
+    """
+    if spectra and all(isinstance(i, sparsespectrum) for i in spectra):
+        return (np.asarray([len(i.index) for i in spectra]),
+                np.concatenate([i.index for i in spectra]),
+                np.concatenate([i.count for i in spectra]))
+
+    flat = todense(spectra).reshape(len(spectra), -1)
+    rows, index = np.nonzero(flat)
+    return np.bincount(rows, minlength=len(spectra)), index, flat[rows, index]
+
+
+def readspectra(nchandle, name='data_raw'):
+    """
+    Read a spectra variable as dense array from an open netCDF file.
+
+    Works for dense (time, diameter, velocity) variables as well as for the
+    ragged layout written in sparse mode (name, name_index, name_count).
+    """
+    if name + '_count' not in nchandle.variables:
+        return np.ma.filled(nchandle.variables[name][:], np.nan)
+
+    # records written without this variable (e.g. data_filtered with qc off) have no bins
+    counts = np.ma.filled(nchandle.variables[name + '_count'][:], 0)
+    shape = (nchandle.dimensions['diameter'].size, nchandle.dimensions['velocity'].size)
+    dense = np.zeros((len(counts), shape[0] * shape[1]))
+    rows = np.repeat(np.arange(len(counts)), counts)
+    dense[rows, nchandle.variables[name + '_index'][:]] = nchandle.variables[name][:]
+    return dense.reshape((len(counts),) + shape)
+
+
+def _newdecompressor(path):
+    # for one gzip member (.gz) or zstd frame (.zst, requires zstandard)
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+class _compressedreader(io.RawIOBase):
+    """
+    Concatenated gzip members or zstd frames, the last one may still be open.
+
+    The asdogz/asdozst writers flush every batch without ending the stream,
+    so everything written so far is readable while the day is running.
+    complete tells whether the last member has been finished.
+    """
+
+    def __init__(self, path, chunksize=2**16):
+        self.path = path
+        self.fo = open(path, 'rb')
+        self.chunksize = chunksize
+        self.decompressor = _newdecompressor(path)
+        self.started = False
+        self.decompressed = b''
+
+    def readable(self):
+        return True
+
+    @property
+    def complete(self):
+        return not self.started or self.decompressor.eof
+
+    def readinto(self, b):
+        while not self.decompressed:
+            if self.decompressor.eof:
+                # the next member starts right after this one
+                data = self.decompressor.unused_data or self.fo.read(self.chunksize)
+                self.decompressor = _newdecompressor(self.path)
+                self.started = False
+            else:
+                data = self.fo.read(self.chunksize)
+            if not data:
+                return 0
+            self.started = True
+            self.decompressed = self.decompressor.decompress(data)
+
+        n = min(len(b), len(self.decompressed))
+        b[:n] = self.decompressed[:n]
+        self.decompressed = self.decompressed[n:]
+        return n
+
+    def close(self):
+        self.fo.close()
+        super().close()
+
+
+def openasdofile(path):
+    # ASDO csv as text, also gzip (.gz) or zstd (.zst, requires zstandard) compressed
+    if path.endswith(('.gz', '.zst')):
+        return io.TextIOWrapper(io.BufferedReader(_compressedreader(path)))
+    return open(path)
+
+
+def _asdotimes(lines, datecolumn, timecolumn):
+    # unix times of ASDO lines (bytes), nan for lines without a valid date/time
+    days = {}
+    times = np.full(len(lines), np.nan)
+    for i, line in enumerate(lines):
+        line = line.split(b',', max(datecolumn, timecolumn) + 1)
+        try:
+            day = line[datecolumn]
+            if day not in days:
+                days[day] = datetime.datetime.strptime(day.decode(), '%d.%m.%Y').replace(
+                    tzinfo=datetime.timezone.utc).timestamp()
+            hours, minutes, seconds = line[timecolumn].split(b':')
+            times[i] = days[day] + 3600 * int(hours) + 60 * int(minutes) + int(seconds)
+        except (IndexError, ValueError):
+            continue
+    return times
+
+
+def asdoindex(path):
+    """
+    Byte-offset index of the records of a (plain) ASDO csv file by time.
+
+    The index is cached next to the file (path + '.idx') and, as the files
+    are only appended to, extended by the new lines when the file grew.
+    Only complete lines are indexed.
+
+    Returns
+    -------
+    times : array of float
+        Unix time of every record, sorted.
+    offsets, lengths : array of int
+        Byte offset and length of the line of every record.
+
+    """
+    datecolumn = telegramfields['21'].csvcolumn
+    timecolumn = telegramfields['20'].csvcolumn
+    indexfile = path + '.idx'
+    stat = os.stat(path)
+
+    times, offsets, lengths, size = np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int), 0
+    try:
+        with np.load(indexfile) as cached:
+            if int(cached['size']) <= stat.st_size:
+                times, offsets, lengths = cached['times'], cached['offsets'], cached['lengths']
+                size = int(cached['size'])
+                if size == stat.st_size and int(cached['mtime']) == stat.st_mtime_ns:
+                    return times, offsets, lengths
+    except (OSError, KeyError, ValueError):
+        pass
+
+    with open(path, 'rb') as fo:
+        fo.seek(size)
+        lines = fo.read().split(b'\n')[:-1]
+
+    # the header has no valid time
+    newlengths = np.asarray([len(i) + 1 for i in lines], dtype=int)
+    newoffsets = size + np.concatenate([[0], np.cumsum(newlengths)[:-1]]).astype(int)
+    newtimes = _asdotimes(lines, datecolumn, timecolumn)
+    valid = np.isfinite(newtimes)
+
+    times = np.concatenate([times, newtimes[valid]])
+    offsets = np.concatenate([offsets, newoffsets[valid]])
+    lengths = np.concatenate([lengths, newlengths[valid]])
+    # late records (e.g. drained from the spool) may be out of order
+    order = np.argsort(times, kind='stable')
+    times, offsets, lengths = times[order], offsets[order], lengths[order]
+    size += int(newlengths.sum())
+
+    try:
+        with open(indexfile + '.tmp', 'wb') as fo:
+            np.savez(fo, times=times, offsets=offsets, lengths=lengths,
+                     size=size, mtime=stat.st_mtime_ns)
+        os.replace(indexfile + '.tmp', indexfile)
+    except OSError as e:
+        # e.g. a read-only archive, the index is just not cached then
+        print(f'Could not cache the index of {path}: {e}')
+    return times, offsets, lengths
+
+
+def readasdofile(path, start=None, end=None, columns=None):
+    """
+    Read the records between start and end (unix time, inclusive) of an ASDO csv file.
+
+    Plain files are read through asdoindex, i.e. only the lines of the
+    requested range are read, compressed ones are scanned. The spectrum
+    is only decoded if 93 is in columns.
+
+    Parameters
+    ----------
+    columns : list of str
+        Codes to read (see telegramfields), default all columns of the file.
+
+    Returns
+    -------
+    data : dict
+        'time' (unix time) and the codes as arrays, numbers as float with
+        nan for missing values, 93 as counts of shape (records, 32, 32).
+
+    """
+    start = -np.inf if start is None else start
+    end = np.inf if end is None else end
+
+    with openasdofile(path) as fo:
+        header = fo.readline().rstrip('\n').split(',')
+
+    codes = {field.csvheader: code for code, field in telegramfields.items()
+             if field.csvheader is not None}
+    filecolumns = {codes.get(name, name): column for column, name in enumerate(header)}
+    spectrumcode = [code for code in filecolumns if code == '93']
+    if columns is None:
+        columns = list(filecolumns)
+    scalars = [code for code in columns if code in filecolumns and code not in spectrumcode]
+
+    if path.endswith(('.gz', '.zst')):
+        with openasdofile(path) as fo:
+            next(fo)
+            lines = [line.encode() for line in fo]
+        times = _asdotimes(lines, filecolumns['21'], filecolumns['20'])
+        selected = np.flatnonzero((times >= start) & (times <= end))
+        lines = [lines[i] for i in selected]
+        times = times[selected]
+    else:
+        times, offsets, lengths = asdoindex(path)
+        first, last = np.searchsorted(times, start, 'left'), np.searchsorted(times, end, 'right')
+        times, offsets, lengths = times[first:last], offsets[first:last], lengths[first:last]
+        with open(path, 'rb') as fo:
+            if len(offsets) and np.all(np.diff(offsets) == lengths[:-1]):
+                # the usual case, one contiguous block
+                fo.seek(offsets[0])
+                lines = fo.read(offsets[-1] + lengths[-1] - offsets[0]).split(b'\n')[:-1]
+            else:
+                lines = []
+                for offset, length in zip(offsets, lengths):
+                    fo.seek(offset)
+                    lines.append(fo.read(length).rstrip(b'\n'))
+
+    data = {'time': times}
+    # the spectrum is the last column and never has to be split for scalars
+    maxcolumn = max([filecolumns[code] for code in scalars], default=0) + 1
+    rows = [line.split(b',', maxcolumn) for line in lines]
+    for code in scalars:
+        column = filecolumns[code]
+        values = [row[column].decode() if column < len(row) else '' for row in rows]
+        if telegramfields.get(code, telegramfield(code)).dtype == 'S':
+            data[code] = np.asarray(values)
+            continue
+        numbers = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                numbers[i] = float(value)
+            except ValueError:
+                pass
+        data[code] = numbers
+
+    if '93' in columns and spectrumcode:
+        shape = telegramfields['93'].shape
+        spectra = np.zeros((len(lines), int(np.prod(shape))))
+        for i, line in enumerate(lines):
+            body = line.partition(b'<SPECTRUM>')[2].partition(b'</SPECTRUM>')[0]
+            if body and body != b'ZERO':
+                spectra[i] = [int(j) if j else 0 for j in body.split(b',')]
+        data['93'] = spectra.reshape((len(lines),) + shape)
+    return data
+
+
+def _parsenumber(value):
+    # float if there is exactly one decimal point, int otherwise
+    if '.' in value and value.count('.') == 1:
+        return float(value)
+    return int(value)
+
+
+def splittelegram(telegram, codec='utf-8'):
+    """
+    Split a CS/PA telegram (bytes) into its unparsed values.
+
+    Returns
+    -------
+    record : dict
+        code (2 letters) -> value string.
+
+    """
+    # convert to sensible string
+    record = telegram.strip(b'\x03').decode(codec).strip()
+    # get different fields into list
+    record = record.split('\r\n')
+    # split into measurement value key and measurement value
+    # the default return is CODE (2 Letters): data (until prev. removed \r\n
+    return {i[:2]: i[3:].rstrip(';').strip() for i in record[1:]}
+
+
+def _parsestring(value):
+    # date, time, software versions, station name and the like stay as is
+    return value
+
+
+def _parsefieldspectrum(value):
+    # 90 and 91, one float per diameter class
+    if not value.strip(';'):
+        return np.zeros(32)
+    return np.asarray([float(i) if i else 0 for i in value.split(';')])
+
+
+def _parserawspectrum(value):
+    # 93, counts per diameter and velocity class
+    if not value.strip(';0'):
+        return np.zeros((32, 32))
+    return np.asarray([int(i) if i else 0 for i in value.split(';')]).reshape(32, 32)
+
+
+def _parsesparsespectrum(value):
+    # 93 as sparsespectrum, only the (few) non-zero bins are converted
+    values = value.split(';')
+    if value.strip(';') and len(values) != 32 * 32:
+        raise ValueError(f'{len(values)} instead of {32 * 32} bins')
+    nonzero = [(i, int(v)) for i, v in enumerate(values) if v.strip('0')]
+    index, count = zip(*nonzero) if nonzero else ((), ())
+    return sparsespectrum(np.asarray(index, dtype='i2'), np.asarray(count, dtype='i4'))
+
+
+# everything known about a telegram code: how to parse it (None skips it),
+# the (per record) dtype/shape and, if written, the nc variable name, its
+# attributes and fill value as well as the ASDO column and header. The
+# transform converts a whole column (array) to the units of the nc file.
+telegramfield = collections.namedtuple(
+    'telegramfield',
+    ['description', 'parser', 'dtype', 'shape', 'transform', 'ncname', 'ncattrs',
+     'fill_value', 'csvcolumn', 'csvheader'],
+    defaults=[_parsenumber, 'd', (), None, None, None, None, None, None])
+
+telegramfields = {
+    '01': telegramfield('Rain intensity 32 bit (mm/h)',
+                        transform=lambda x: x * 60 * 60 / 1000,
+                        ncname='rainfall_rate', fill_value=-999.,
+                        ncattrs={'standard_name': 'rainfall_rate',
+                                 'long_name': 'Precipitation rate',
+                                 'units': 'm s-1',
+                                 'comment': 'Variable 01 - Rain intensity (32 bit) 0000.000'},
+                        csvcolumn=2, csvheader='Intensity of precipitation (mm/h)'),
+    '02': telegramfield('Rain amount accumulated 32 bit (mm)',
+                        csvcolumn=3, csvheader='Precipitation since start (mm)'),
+    '03': telegramfield('Weather code according to SYNOP wawa Table 4680', dtype='i',
+                        ncname='synop_WaWa', fill_value=-999,
+                        ncattrs={'long_name': 'Synop Code WaWa',
+                                 'units': '1',
+                                 'comment': 'Variable 03 - Weather code according to SYNOP wawa Table 4680.'},
+                        csvcolumn=4, csvheader='Weather code SYNOP WaWa'),
+    '04': telegramfield('Weather code according to SYNOP ww Table 4677', dtype='i',
+                        ncname='synop_WW', fill_value=-999,
+                        ncattrs={'long_name': 'Synop Code WW',
+                                 'units': '1',
+                                 'comment': 'Variable 04 - Weather code according to SYNOP ww Table 4677.'}),
+    '05': telegramfield('Weather code METAR/SPECI Table 4678', parser=_parsestring, dtype='S',
+                        csvcolumn=5, csvheader='Weather code METAR/SPECI'),
+    '06': telegramfield('Weather code NWS', parser=_parsestring, dtype='S',
+                        csvcolumn=6, csvheader='Weather code NWS'),
+    '07': telegramfield('Radar reflectivity 32 bit (dBz)',
+                        ncname='radar_reflectivity', fill_value=-999,
+                        ncattrs={'standard_name': 'equivalent_reflectivity_factor',
+                                 'long_name': 'equivalent radar reflectivity factor',
+                                 'units': 'dBZ',
+                                 'comment': 'Variable 07 - Radar reflectivity (32 bit).'},
+                        csvcolumn=7, csvheader='Radar reflectivity (dBz)'),
+    '08': telegramfield('MOR visibility in the precipitation (m)', dtype='i',
+                        ncname='visibility', fill_value=-999,
+                        ncattrs={'long_name': 'Visibility range in precipitation after MOR',
+                                 'units': 'm',
+                                 'comment': 'Variable 08 - MOR visibility in the precipitation.'},
+                        csvcolumn=8, csvheader='MOR Visibility (m)'),
+    '09': telegramfield('Sample interval (s)', dtype='i',
+                        ncname='interval',
+                        ncattrs={'long_name': 'Length of measurement interval',
+                                 'units': 's',
+                                 'comment': 'Variable 09 - Sample interval between two data retrieval requests.'}),
+    '10': telegramfield('Signal amplitude of the laser strip', dtype='i',
+                        ncname='sig_laser',
+                        ncattrs={'long_name': 'Signal amplitude of the laser',
+                                 'units': '1',
+                                 'comment': 'Variable 10 - Signal ambplitude of the laser strip'},
+                        csvcolumn=9, csvheader='Signal amplitude of Laserband'),
+    '11': telegramfield('Number of detected particles', dtype='i',
+                        ncname='n_particles',
+                        ncattrs={'long_name': 'Number of particles in time interval',
+                                 'units': '1',
+                                 'comment': 'Variable 11 - Number of detected particles'},
+                        csvcolumn=10, csvheader='Number of detected particles'),
+    '12': telegramfield('Temperature in the sensor housing (°C)', dtype='i',
+                        transform=lambda x: x + 273.15,
+                        ncname='T_sensor', fill_value=-999,
+                        ncattrs={'long_name': 'Temperature in the sensor',
+                                 'units': 'K',
+                                 'comment': 'Variable 12 - Temperature in the Sensor'},
+                        csvcolumn=11, csvheader='Temperature in sensor (°C)'),
+    '13': telegramfield('Sensor serial number', parser=_parsestring, dtype='S'),
+    '14': telegramfield('Firmware IOP version', parser=_parsestring, dtype='S'),
+    '15': telegramfield('Firmware DSP version', parser=_parsestring, dtype='S'),
+    '16': telegramfield('Sensor head heating current (A)',
+                        ncname='I_heating',
+                        ncattrs={'long_name': 'Heating Current',
+                                 'units': 'A',
+                                 'comment': 'Variable 16 - Current through the heating system.'},
+                        csvcolumn=12, csvheader='Heating current (A)'),
+    '17': telegramfield('Power supply voltage (V)',
+                        ncname='V_sensor',
+                        ncattrs={'long_name': 'Sensor Voltage',
+                                 'units': 'V',
+                                 'comment': 'Variable 17 - Power supply voltage in the sensor.'},
+                        csvcolumn=13, csvheader='Sensor voltage (V)'),
+    '18': telegramfield('Sensor status', dtype='i',
+                        ncname='state_sensor',
+                        ncattrs={'long_name': 'State of the Sensor',
+                                 'units': '1',
+                                 'comment': 'Variable 18 - Sensor status:\n'
+                                            '0: Everything is okay.\n'
+                                            '1: Dirty but measurement possible.\n'
+                                            '2: No measurement possile'},
+                        csvcolumn=14, csvheader='Optics status'),
+    '19': telegramfield('Date/time measuring start', parser=_parsestring, dtype='S'),
+    # sensor date and time, replaced by the time of the acquisition pc
+    '20': telegramfield('Sensor time', parser=_parsestring, dtype='S',
+                        csvcolumn=1, csvheader='Time'),
+    '21': telegramfield('Sensor date', parser=_parsestring, dtype='S',
+                        csvcolumn=0, csvheader='Date'),
+    '22': telegramfield('Station name', parser=_parsestring, dtype='S'),
+    '23': telegramfield('Station number', parser=_parsestring, dtype='S'),
+    '24': telegramfield('Rain amount absolute 32 bit (mm)'),
+    '25': telegramfield('Error code', dtype='i',
+                        ncname='error_code',
+                        ncattrs={'long_name': 'Error Code',
+                                 'units': '1',
+                                 'comment': 'Variable 25 - Error code.'}),
+    '34': telegramfield('Kinetic energy (J/(m2 h))',
+                        ncname='E_kin', fill_value=-999.,
+                        ncattrs={'long_name': 'Kinetic energy of the hydrometeors',
+                                 'units': 'kJ',
+                                 'comment': 'Variable 24 - kinetic Energy of hydrometeors.'},
+                        csvcolumn=15, csvheader='Kinetic Energy'),
+    '35': telegramfield('Snow intensity (mm/h)',
+                        csvcolumn=16, csvheader='Snow intensity (mm/h)'),
+    '90': telegramfield('Field N(d)', parser=_parsefieldspectrum, shape=(32,),
+                        ncname='number_concentration', fill_value=-999.,
+                        ncattrs={'long_name': 'Number of particles per diameter class',
+                                 'units': 'log10(m-3 mm-1)',
+                                 'comment': 'Variable 90 - Field N (d)'}),
+    '91': telegramfield('Field v(d)', parser=_parsefieldspectrum, shape=(32,),
+                        ncname='fall_velocity', fill_value=-999.,
+                        ncattrs={'long_name': 'Average velocity of each diameter class',
+                                 'units': 'm s-1',
+                                 'comment': 'Variable 91 - Field v (d)'}),
+    '93': telegramfield('Raw data', parser=_parserawspectrum, shape=(32, 32),
+                        ncname='data_raw', fill_value=-999.,
+                        ncattrs={'long_name': 'Raw Data as a function of particle diameter and velocity',
+                                 'units': '1',
+                                 'comment': 'Variable 93 - Raw data.'},
+                        csvcolumn=17, csvheader='Spectrum'),
+    # maintenance codes
+    '94': telegramfield('Maintenance', parser=None),
+    '95': telegramfield('Maintenance', parser=None),
+    '96': telegramfield('Maintenance', parser=None),
+    '97': telegramfield('Maintenance', parser=None),
+    '98': telegramfield('Maintenance', parser=None),
+    '99': telegramfield('Maintenance', parser=None),
+    # derived by this program, not part of the telegram
+    '-1': telegramfield('Unix time of the acquisition pc', parser=None),
+    '-2': telegramfield('Offset of the sensor clock (s)', parser=None,
+                        ncname='clock_offset', fill_value=-999.,
+                        ncattrs={'long_name': 'Offset of the sensor clock',
+                                 'units': 's',
+                                 'comment': 'Variable 20/21 - Sensor date/time minus time on '
+                                            'data acquisition pc, 1 s resolution.'}),
+    '-3': telegramfield('Quality control flag', parser=None, dtype='i',
+                        ncname='qc_flag',
+                        ncattrs={'long_name': 'Quality control flag',
+                                 'units': '1',
+                                 'flag_masks': np.asarray([1, 2, 4, 8], dtype='i'),
+                                 'flag_meanings': 'n_particles_mismatch sensor_state_not_ok '
+                                                  'error_code_set mostly_filtered',
+                                 'comment': 'Bitmask, 0 means no issue was found.'}),
+    '-4': telegramfield('Raw data after velocity/diameter filter', parser=None, shape=(32, 32),
+                        ncname='data_filtered', fill_value=-999.,
+                        ncattrs={'long_name': 'Raw Data after velocity/diameter filter',
+                                 'units': '1',
+                                 'comment': 'Variable 93 - Raw data with bins outside of '
+                                            'vd_tolerance of the fall velocity of raindrops '
+                                            '(Atlas et al. 1973) set to 0.'}),
+    '-5': telegramfield('Time without data before the record (s)', parser=None,
+                        ncname='time_gap',
+                        ncattrs={'long_name': 'Time without data before this record',
+                                 'units': 's',
+                                 'comment': 'Non-zero after the serial connection had to be '
+                                            'reopened, 0 otherwise.'}),
+}
+
+
+# live frames: magic and body length, then unix time, number of scalars and
+# of non-zero spectrum bins, followed by (code, value) and (index, count) pairs
+liveframeheader = struct.Struct('<4sI')
+liverecordheader = struct.Struct('<dHH')
+livescalar = struct.Struct('<2sd')
+livebin = struct.Struct('<HH')
+liveframemagic = b'PSVL'
+
+
+def encodeframe(unixtime, scalars, spectrum=None):
+    """
+    Pack one record into a live frame (see parsivel_liveserver).
+
+    scalars is a dict of two letter code and number, spectrum the 93 of
+    the record, dense or as sparsespectrum.
+    """
+    if spectrum is None:
+        index, count = [], []
+    else:
+        _, index, count = toragged([spectrum])
+        # dense spectra come back as float counts, struct only packs integers
+        index, count = index.astype(int), count.astype(int)
+
+    body = [liverecordheader.pack(unixtime, len(scalars), len(index))]
+    body += [livescalar.pack(code.encode('ascii'), value) for code, value in scalars.items()]
+    body += [livebin.pack(i, j) for i, j in zip(index, count)]
+    body = b''.join(body)
+    return liveframeheader.pack(liveframemagic, len(body)) + body
+
+
+def decodeframe(frame):
+    """
+    Unpack a live frame.
+
+    Returns
+    -------
+    unixtime : float
+        Time of the record on the acquisition pc.
+    scalars : dict
+        Value per telegram code.
+    spectrum : sparsespectrum
+        Non-zero bins of 93 as flat index and count.
+
+    """
+    magic, length = liveframeheader.unpack_from(frame)
+    assert magic == liveframemagic, 'Not a parsivel live frame'
+
+    offset = liveframeheader.size
+    unixtime, nscalars, nbins = liverecordheader.unpack_from(frame, offset)
+    offset += liverecordheader.size
+
+    scalars = {}
+    for code, value in livescalar.iter_unpack(frame[offset:offset + nscalars * livescalar.size]):
+        scalars[code.decode('ascii')] = value
+    offset += nscalars * livescalar.size
+
+    bins = np.frombuffer(frame, dtype='<u2', count=2 * nbins, offset=offset).reshape(-1, 2)
+    return unixtime, scalars, sparsespectrum(bins[:, 0].astype('i2'), bins[:, 1].astype('i4'))
+
+
+def readframe(sock):
+    """
+    Read one live frame from a connected subscriber socket, None on disconnect.
+    """
+    def _recv(nbytes):
+        chunks = b''
+        while len(chunks) < nbytes:
+            chunk = sock.recv(nbytes - len(chunks))
+            if not chunk:
+                return None
+            chunks += chunk
+        return chunks
+
+    header = _recv(liveframeheader.size)
+    if header is None:
+        return None
+    body = _recv(liveframeheader.unpack(header)[1])
+    if body is None:
+        return None
+    return decodeframe(header + body)
+
+
+def loadconfig(configfile):
+    """
+    Read a station config file, either TOML or YAML (requires PyYAML).
+
+    The file can hold the sections serial (port, baudrate), station
+    (stationname, outpath, fileprefix), sampling (samplinginterval,
+    writeoutfreq, maxsampling, adaptive, dryinterval, eventinterval,
+    eventhold, eventintensity, eventparticles), qc (enabled, vdtolerance,
+    particletolerance, maxfiltered), output (formats, intosubdirs, sparse,
+    maxbufferbytes, spoolpath, maxspoolbytes, maxwriteattempts, catalog), live (address, maxqueue,
+    droppolicy) and ncmeta (global attributes of the
+    netCDF files) as well as the toplevel key quiet. Several parsivels on
+    one RS-485 port are configured by bus (addresstemplate, timeout) and a
+    list of sensors (see parsivel_bus.fromconfig).
+
+    Returns
+    -------
+    config : dict
+        The parsed config, sections missing from the file are empty dicts.
+
+    Raises
+    ------
+    ValueError
+        If the config holds values that could not be applied, so nothing of
+        it is applied (see checkconfig).
+
+    """
+    with open(configfile, 'rb') as fo:
+        if configfile.endswith(('.yaml', '.yml')):
+            import yaml
+            config = yaml.safe_load(fo) or {}
+        else:
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+            config = tomllib.load(fo)
+
+    for section in ['serial', 'station', 'sampling', 'qc', 'output', 'live', 'ncmeta', 'bus']:
+        config.setdefault(section, {})
+    config.setdefault('sensors', [])
+    checkconfig(config)
+    return config
+
+
+# config sections of the keyword arguments of fromconfig, others are toplevel keys
+configsections = {'port': 'serial', 'baudrate': 'serial', 'outpath': 'station',
+                  'stationname': 'station'}
+
+
+def overrideconfig(config, overrides):
+    """
+    Put overrides (e.g. command line arguments, as keyword arguments of fromconfig) into config.
+    """
+    for key, value in overrides.items():
+        section = configsections.get(key)
+        (config[section] if section else config)[key] = value
+    return config
+
+
+def checkconfig(config):
+    """
+    Check the values of a config read by loadconfig before any of it is applied.
+
+    Raises
+    ------
+    ValueError
+        Listing every value that is invalid.
+
+    """
+    problems = []
+    numeric = {'sampling': ['samplinginterval', 'writeoutfreq', 'maxsampling', 'dryinterval',
+                            'eventinterval', 'eventhold', 'eventintensity', 'eventparticles'],
+               'qc': ['vdtolerance', 'particletolerance', 'maxfiltered'],
+               'output': ['maxbufferbytes', 'maxspoolbytes', 'maxwriteattempts'],
+               'live': ['maxqueue'],
+               'serial': ['baudrate']}
+    for section, keys in numeric.items():
+        for key in keys:
+            value = config[section].get(key, 0)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                problems += [f'{section}.{key} = {value!r} is not a number']
+
+    formats = config['output'].get('formats', [])
+    unknown = [i for i in formats if i not in writerbackends]
+    if isinstance(formats, str) or unknown:
+        problems += [f'output.formats {formats!r} has unknown formats, use {list(writerbackends)}']
+
+    live = config['live']
+    if live.get('droppolicy', 'oldest') not in ['oldest', 'newest']:
+        problems += [f'live.droppolicy = {live["droppolicy"]!r} is not oldest or newest']
+    address = live.get('address')
+    if address and not isinstance(address, str):
+        problems += [f'live.address = {address!r} is not a path or host:port']
+    elif address and ':' in address and not address.rsplit(':', 1)[1].isdigit():
+        problems += [f'live.address = {address!r} has no valid port']
+
+    if problems:
+        raise ValueError('; '.join(problems))
+
 
 class parsivel_moxa(serial.Serial):
     def __init__(self,
@@ -54,6 +802,26 @@ class parsivel_moxa(serial.Serial):
         # for automatic polling, the time resolution in seconds
         self.samplinginterval = 10
         self.maxsampling = 60 * 15 * self.samplinginterval
+        # how often to write out, None means every samplinginterval
+        self.writeoutfreq = None
+        # adaptive sampling: dryinterval without precipitation, eventinterval
+        # from the first record with precipitation until none for eventhold seconds
+        self.adaptive = False
+        self.dryinterval = 60
+        self.eventinterval = 10
+        self.eventhold = 600
+        # a record has precipitation above these 01 intensity (mm/h) and 11
+        # particle counts or with a non-zero synop code (03 wawa, 04 ww)
+        self.eventintensity = 0.1
+        self.eventparticles = 10
+        self.lastprecipitation = None
+        # config file this instance was created from, reread on SIGHUP, and
+        # the arguments of fromconfig that take precedence over it
+        self.configfile = None
+        self.cliargs = {}
+        # flags set by the signal handlers and checked in the sampling loop
+        self.running = False
+        self.reloadrequested = False
         # where to store the data
         self.outpath = outpath
         # the prefix for the file to be used
@@ -65,26 +833,95 @@ class parsivel_moxa(serial.Serial):
         # holder for all written files, will be filled by subroutines
         self.csvfiles = []
         self.ncfiles = []
-        # dict to hold data order by variable
-        self.data = {'-1': []}
+        # dict to hold data order by variable, -1 is the unix time of the
+        # acquisition pc, -2 the offset of the sensor clock to it and -5 the
+        # seconds without data before a record (after a reconnect)
+        self.data = {'-1': [], '-2': [], '-5': []}
         # to keep track of whether we expect data in the buffer
         self.polled = False
         # for waiting a tenth of a second for new bytes in the buffer
         self.waitdt = 0.1
         # to keep track of the waiting time
         self.waittime = 0
+        # the configuration from CS/L, see getconfig
+        self.deviceconfig = None
         # the upper limit of waiting
         self.maxwait = 3
+        # delay before reopening the port after a serial error, doubled up to
+        # maxreconnectdelay seconds per failed attempt
+        self.reconnectdelay = 1
+        self.maxreconnectdelay = 60
+        # unix time of the last record and, after a reconnect, the start of the gap
+        self.lastrecordtime = None
+        self.gapstart = None
+        self.reconnects = 0
+        # the sensor clock is only set when it is off by more than this (seconds)
+        self.clockthreshold = 2
+        # number of telegrams needed before the clock estimate is trusted
+        self.clockminsamples = 6
+        # max number of (unixtime, offset) pairs used for the estimate
+        self.clockwindow = 8640
+        self.clockoffsets = collections.deque()
+        # running sums n, t, o, t*t, t*o of the pairs, t relative to clockreference
+        self.clocksums = np.zeros(5)
+        self.clockreference = None
+        # current estimate of offset (s) and drift (s/s) of the sensor clock
+        self.clockoffset = None
+        self.clockdrift = None
+        # quality control of every batch before it is written out
+        self.qc = True
+        # allowed relative deviation from the fall velocity of rain (Atlas et al. 1973)
+        self.qcvdtolerance = 0.5
+        # allowed relative deviation between spectrum sum and 11 n_particles
+        self.qcparticletolerance = 0.1
+        # flag records where the filter removed more than this fraction
+        self.qcmaxfiltered = 0.5
+        # 32x32 mask of plausible velocity/diameter bins, built on first use
+        self.qcmask = None
+        # keep 93 as sparsespectrum in memory and write spectra as ragged
+        # arrays (NETCDF4) into new nc files
+        self.sparse = False
+        # batches that still have to be written, as [data, pending writer names,
+        # failed attempts by writer name]
+        self.pending = collections.deque()
+        # max bytes of records held in memory, older batches are spilled to disk
+        self.maxbufferbytes = 64 * 2**20
+        # where spilled batches are queued, None means .spool/ in outpath
+        self.spoolpath = None
+        # max bytes on disk for spilled batches, the oldest are dropped beyond
+        self.maxspoolbytes = 2**30
+        # after a failed write, retrying that writer is delayed by up to
+        # maxwritebackoff seconds, both per writer name
+        self.writebackoff = {}
+        self.maxwritebackoff = 600
+        self.nextwriteattempt = {}
+        # a batch a writer fails on this often with anything but an OSError is
+        # moved to deadletter/ in the spool directory, so the writer carries on
+        self.maxwriteattempts = 3
+        self.spoolcounter = 0
+        # writer names each spool file is still pending for, saves reloading them
+        self.spoolpending = {}
+        self.metrics = {'buffered_bytes': 0, 'buffered_batches': 0,
+                        'spooled_bytes': 0, 'spooled_batches': 0,
+                        'spilled_bytes': 0, 'spilled_batches': 0,
+                        'drained_batches': 0, 'dropped_batches': 0,
+                        'write_failures': 0, 'deadletter_batches': 0,
+                        }
+        # publishes every record to local subscribers, see startliveserver
+        self.liveserver = None
+        # output backends (see writerbackends), in the order they are written
+        self.outputformats = ['asdo', 'nc']
+        self.writers = []
+        # index of the written files, see opencatalog
+        self.catalog = None
         # increment buffersize to hold more than one record, maybe useless
         self.ReadBufferSize = 2**16;
-        # default output order, ASDO compatible
-        self.csvoutputorder = ['21','20', '01', '02', '03', '05', '06', '07',
-                            '08', '10', '11', '12', '16', '17', '18', '34', '35', '93']
-        # default output header, ASDO compatible
-        self.csvheader = ['Date', 'Time', 'Intensity of precipitation (mm/h)', 'Precipitation since start (mm)', 'Weather code SYNOP WaWa',]
-        self.csvheader += ['Weather code METAR/SPECI', 'Weather code NWS', 'Radar reflectivity (dBz)', 'MOR Visibility (m)', ]
-        self.csvheader += ['Signal amplitude of Laserband', 'Number of detected particles', 'Temperature in sensor (°C)', ]
-        self.csvheader += ['Heating current (A)', 'Sensor voltage (V)', 'Optics status', 'Kinetic Energy', 'Snow intensity (mm/h)', 'Spectrum']
+        # default output order and header, ASDO compatible
+        csvfields = sorted([(field.csvcolumn, code, field.csvheader)
+                            for code, field in telegramfields.items()
+                            if field.csvcolumn is not None])
+        self.csvoutputorder = [i[1] for i in csvfields]
+        self.csvheader = [i[2] for i in csvfields]
         # add meta info forr ncfile
         self.ncmeta = {
                        'Source': 'OTT Parsivel-2 optical disdrometer',
@@ -97,37 +934,20 @@ class parsivel_moxa(serial.Serial):
                                   " should be reported to the contact person(s).",
                      }
 
-        self.ncmapping = {'09': 'interval',
-                          '25': 'error_code',
-                          '16': 'I_heating',
-                          '17': 'V_sensor',
-                          '18': 'state_sensor',
-                          '10': 'sig_laser',
-                          '01': 'rainfall_rate',
-                          #'02': 'RR_total',
-                          '03': 'synop_WaWa',
-                          '04': 'synop_WW',
-                          '07': 'radar_reflectivity',
-                          '08': 'visibility',
-                          '12': 'T_sensor',
-                          '11': 'n_particles',
-                          #'24': 'RR_accum',
-                          '34': 'E_kin',
-                          '90': 'number_concentration',
-                          '91': 'fall_velocity',
-                          '93': 'data_raw',
-                         }
-        
-        self.nctransformation = {'01': lambda x: x * 60 * 60 / 1000,
-                                 '12': lambda x: x + 273.15,
-                         }
-       
+        # code -> nc variable name and code -> unit conversion of a whole column
+        self.ncmapping = {code: field.ncname for code, field in telegramfields.items()
+                          if field.ncname is not None}
+        self.nctransformation = {code: field.transform for code, field in telegramfields.items()
+                                 if field.transform is not None}
+
         # add any other information from ncmeta
         for key, value in ncmeta.items():
            #if key.lower() in ['name', 'location']:
            #    key = f'Station_{key}'
            self.ncmeta[key] = value
 
+        self.setwriters(self.outputformats)
+
         if not self.isOpen():
             self.open()
 
@@ -137,6 +957,142 @@ class parsivel_moxa(serial.Serial):
         self.close()
         time.sleep(1)
 
+    @classmethod
+    def fromconfig(cls, configfile, **kwargs):
+        """
+        Create an instance from a TOML/YAML config file (see loadconfig).
+
+        Keyword arguments that are not None take precedence over the
+        values from the config file and are passed on to __init__.
+        """
+        config = loadconfig(configfile)
+        cliargs = {key: value for key, value in kwargs.items() if value is not None}
+        initkwargs = {'port': config['serial'].get('port', '/dev/ttyUSB0'),
+                      'baudrate': config['serial'].get('baudrate', 57600),
+                      'outpath': config['station'].get('outpath', './'),
+                      'stationname': config['station'].get('stationname', 'Eriswil'),
+                      'quiet': config.get('quiet', True),
+                      }
+        if config['ncmeta']:
+            initkwargs['ncmeta'] = config['ncmeta']
+        initkwargs.update(cliargs)
+
+        parsivel = cls(**initkwargs)
+        parsivel.configfile = configfile
+        parsivel.cliargs = cliargs
+        parsivel.applyconfig(config, initial=True)
+        return parsivel
+
+    def applyconfig(self, config, initial=False):
+        # everything that can change without reopening the serial port
+        station = config['station']
+        sampling = config['sampling']
+
+        self.quiet = config.get('quiet', self.quiet)
+        self.fileprefix = station.get('fileprefix', self.fileprefix)
+        self.samplinginterval = sampling.get('samplinginterval', self.samplinginterval)
+        self.writeoutfreq = sampling.get('writeoutfreq', self.writeoutfreq)
+        self.maxsampling = sampling.get('maxsampling', self.maxsampling)
+        self.adaptive = sampling.get('adaptive', self.adaptive)
+        self.dryinterval = sampling.get('dryinterval', self.dryinterval)
+        self.eventinterval = sampling.get('eventinterval', self.eventinterval)
+        self.eventhold = sampling.get('eventhold', self.eventhold)
+        self.eventintensity = sampling.get('eventintensity', self.eventintensity)
+        self.eventparticles = sampling.get('eventparticles', self.eventparticles)
+        for key, value in config['ncmeta'].items():
+            self.ncmeta[key] = value
+
+        qc = config['qc']
+        self.qc = qc.get('enabled', self.qc)
+        self.qcparticletolerance = qc.get('particletolerance', self.qcparticletolerance)
+        self.qcmaxfiltered = qc.get('maxfiltered', self.qcmaxfiltered)
+        if qc.get('vdtolerance', self.qcvdtolerance) != self.qcvdtolerance:
+            self.qcvdtolerance = qc['vdtolerance']
+            self.qcmask = None
+
+        output = config['output']
+        self.sparse = output.get('sparse', self.sparse)
+        self.maxbufferbytes = output.get('maxbufferbytes', self.maxbufferbytes)
+        self.maxspoolbytes = output.get('maxspoolbytes', self.maxspoolbytes)
+        self.maxwriteattempts = output.get('maxwriteattempts', self.maxwriteattempts)
+        self.spoolpath = output.get('spoolpath', self.spoolpath)
+        if output.get('catalog') and self.catalog is None:
+            # true for the default location
+            self.opencatalog(None if output['catalog'] is True else output['catalog'])
+        if output.get('formats', self.outputformats) != self.outputformats \
+                or 'intosubdirs' in output:
+            self.setwriters(output.get('formats', self.outputformats),
+                            intosubdirs=output.get('intosubdirs', True))
+
+        live = config['live']
+        if live.get('address') and self.liveserver is None:
+            self.startliveserver(live['address'],
+                                 maxqueue=live.get('maxqueue', 100),
+                                 droppolicy=live.get('droppolicy', 'oldest'))
+
+        if initial:
+            return
+
+        if 'outpath' in station and station['outpath'] != self.outpath:
+            self.outpath = station['outpath']
+            # the catalog at the default location moves along
+            if self.catalog is not None and output.get('catalog') is True:
+                self.opencatalog()
+
+        if station.get('stationname', self.stationname)[:10] != self.stationname:
+            self.stationname = station['stationname'][:10]
+            self.setstationname()
+
+        baudrate = config['serial'].get('baudrate', self.baudrate)
+        if baudrate != self.baudrate:
+            # pyserial reconfigures an open port in place
+            self.baudrate = baudrate
+
+        port = config['serial'].get('port', self.port)
+        if port != self.port:
+            print(f'Port change to {port} requires a restart, keeping {self.port}')
+
+    def reloadconfig(self):
+        self.reloadrequested = False
+        if self.configfile is None:
+            return
+
+        try:
+            config = overrideconfig(loadconfig(self.configfile), self.cliargs)
+        except Exception as e:
+            print(f'Reloading {self.configfile} failed, keeping current config: {e}')
+            return
+
+        try:
+            self.applyconfig(config)
+        except Exception as e:
+            # e.g. the live address cannot be bound, sampling goes on regardless
+            print(f'Applying {self.configfile} failed partly, continuing: {e}')
+            return
+        print(f'Reloaded config from {self.configfile}')
+
+    def _onsighup(self, signum, frame):
+        # only flag it, the reload happens between two samples
+        self.reloadrequested = True
+
+    def _onsigterm(self, signum, frame):
+        self.running = False
+
+    def run(self):
+        """
+        Sample indefinitely as a daemon.
+
+        SIGHUP rereads the config file without closing the serial port,
+        SIGTERM stops sampling after writing out the buffered records.
+        Files rotate daily as every day gets its own nc/csv file.
+        """
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._onsighup)
+        signal.signal(signal.SIGTERM, self._onsigterm)
+
+        self.maxsampling = -1
+        self.sample()
+
     def settime(self):
 
         if not self.isOpen():
@@ -149,6 +1105,8 @@ class parsivel_moxa(serial.Serial):
         if not self.quiet:
             print('Sending settime command ', cmd)
         update = self.write(cmd)
+        # the cached configuration is outdated now
+        self.deviceconfig = None
         self.flush()
         time.sleep(2)
         answer = b''
@@ -191,6 +1149,8 @@ class parsivel_moxa(serial.Serial):
         if not self.quiet:
             print('Sending setdate command to parsivel ', cmd)
         update = self.write(cmd)
+        # the cached configuration is outdated now
+        self.deviceconfig = None
         self.flush()
         time.sleep(2)
         answer = b''
@@ -232,6 +1192,8 @@ class parsivel_moxa(serial.Serial):
         if not self.quiet:
             print('Sending setrtc command', cmd)
         update = self.write(cmd)
+        # the cached configuration is outdated now
+        self.deviceconfig = None
         self.flush()
         time.sleep(2)
         answer = b''
@@ -270,16 +1232,18 @@ class parsivel_moxa(serial.Serial):
         time.sleep(0.2)
         # max of 10 letter allowed
         sname = self.stationname[:10]
-        cmd = b'CS/K/'+bytes(sname.encode(self.codec))
+        cmd = b'CS/K/'+bytes(sname.encode(self.codec))+b'\r'
         if not self.quiet:
             print('Sending setstationname command to parsivel', cmd)
         update = self.write(cmd)
+        # the cached configuration is outdated now
+        self.deviceconfig = None
         self.flush()
         time.sleep(2)
         answer = b''
         if self.in_waiting > 0:
             answer = self.read(size=self.in_waiting)
-            print('Answer to setstationname ({sname}) from parsivel was', answer)
+            print(f'Answer to setstationname ({sname}) from parsivel was', answer)
         self.flush()
         return answer.strip(b'\r\nOK\r\n\n').decode(self.codec).strip()
 
@@ -314,120 +1278,299 @@ class parsivel_moxa(serial.Serial):
         self.setdate()
         self.settime()
 
+    def getdatetime(self):
+        """
+        Read the rtc of the parsivel once.
+
+        Returns
+        -------
+        sensortime : datetime.datetime or None
+            The sensor time or None if the answer could not be parsed.
+        hosttime : datetime.datetime
+            The time of the acquisition pc when the request was sent.
+
+        """
+        hosttime = datetime.datetime.utcnow()
+        answer = self.getrtc()
+        try:
+            sensortime = datetime.datetime.strptime(answer.split('\r\n')[0].strip(),
+                                                    '%d.%m.%Y %H:%M:%S')
+        except ValueError:
+            sensortime = None
+        return sensortime, hosttime
+
+    def updateclock(self, sensordate, sensortime, hosttime):
+        """
+        Add one sensor timestamp (date/time of code 21/20) to the clock estimate.
+
+        The offset (sensor minus host in seconds) and drift (s/s) are
+        estimated by a linear fit over the last clockwindow telegrams which
+        averages out the 1 s resolution of the telegram time.
+
+        Returns
+        -------
+        offset : float
+            The measured offset of this telegram, nan if unparseable.
+
+        """
+        try:
+            sensortime = datetime.datetime.strptime(f'{sensordate} {sensortime}',
+                                                    '%d.%m.%Y %H:%M:%S')
+        except (TypeError, ValueError):
+            return np.nan
+
+        # telegram time has no fractional seconds, so neither has the reference
+        offset = (sensortime - hosttime.replace(microsecond=0)).total_seconds()
+        unixtime = datetime.datetime.timestamp(hosttime)
+        self.clockoffsets.append((unixtime, offset))
+        if self.clockreference is None \
+                or unixtime - self.clockreference > 2 * (unixtime - self.clockoffsets[0][0]) + 1:
+            self._resetclocksums()
+        else:
+            self.clocksums += self._clockterms(unixtime, offset)
+            while len(self.clockoffsets) > self.clockwindow:
+                self.clocksums -= self._clockterms(*self.clockoffsets.popleft())
+
+        if len(self.clockoffsets) < self.clockminsamples:
+            return offset
+
+        # least squares from the running sums, so every telegram costs the same
+        n, st, so, stt, sto = self.clocksums
+        variance = n * stt - st**2
+        if variance > 1e-9 * max(n * stt, 1):
+            self.clockdrift = (n * sto - st * so) / variance
+            # intercept at the latest telegram
+            self.clockoffset = (so - self.clockdrift * st) / n \
+                + self.clockdrift * (unixtime - self.clockreference)
+        else:
+            self.clockoffset = so / n
+        return offset
+
+    def _clockterms(self, unixtime, offset):
+        t = unixtime - self.clockreference
+        return np.array([1, t, offset, t * t, t * offset])
+
+    def _resetclocksums(self):
+        # recomputed now and then, which bounds rounding errors of the running sums
+        while len(self.clockoffsets) > self.clockwindow:
+            self.clockoffsets.popleft()
+        self.clockreference = self.clockoffsets[0][0]
+        self.clocksums = np.zeros(5)
+        for unixtime, offset in self.clockoffsets:
+            self.clocksums += self._clockterms(unixtime, offset)
+
+    def clockisoff(self):
+        # whether the estimate from the telegrams is trusted and beyond clockthreshold
+        return (self.clockoffset is not None
+                and len(self.clockoffsets) >= self.clockminsamples
+                and abs(self.clockoffset) > self.clockthreshold)
+
+    def syncclock(self, force=False):
+        """
+        Set date/time of the parsivel only if it is off by more than clockthreshold.
+
+        Without an estimate from telegrams yet, the rtc is read once.
+
+        Returns
+        -------
+        synced : bool
+            Whether the clock of the parsivel has been set.
+
+        """
+        if not force:
+            if self.clockoffset is None:
+                sensortime, hosttime = self.getdatetime()
+                if sensortime is not None:
+                    self.clockoffset = (sensortime - hosttime.replace(microsecond=0)).total_seconds()
+
+            if self.clockoffset is not None and abs(self.clockoffset) <= self.clockthreshold:
+                return False
+
+        if not self.quiet:
+            print(f'Sensor clock is off by {self.clockoffset} seconds, setting it')
+        self.setdatetime()
+        # older offsets refer to the clock before it was set
+        self.clockoffsets.clear()
+        self.clockreference = None
+        self.clockoffset = None
+        self.clockdrift = None
+        return True
+
+    def checkstationname(self):
+        # the station name is part of the telegram (22), only ask when it is not
+        if self.data.get('22'):
+            sname = self.data['22'][-1]
+        else:
+            sname = self.getstationname()
+
+        if sname != self.stationname[:10]:
+            self.setstationname()
+            return False
+        return True
+
     def setup(self):
         if not self.isOpen():
             self.open()
             time.sleep(1)
 
-        #sname = self.getstationname()
-        self.setstationname()
-        self.setdatetime()
+        # the station name is checked with the first telegram in sample
+        self.syncclock()
         self.flush()
 
-    def pollcode(self, code):
+    def _exchange(self, command, terminator=b'\r\n'):
+        """
+        Send command and read the answer (bytes) until terminator, without fixed sleeps.
+
+        With terminator None, the answer is complete once no new bytes
+        arrived for waitdt seconds. Gives up after maxwait seconds.
+        """
         if not self.isOpen():
             self.open()
-            time.sleep(1)
-
-        self.flush()
-        self.clearbuffer()
 
-        thispollcmd = str(code)
+        self.reset_input_buffer()
+        self.write(command)
 
-        if int(thispollcmd) >= 90:
-            delim = ';'
-            sleeptime = 1
+        answer = b''
+        waittime = 0
+        while waittime <= self.maxwait:
+            time.sleep(self.waitdt)
+            waittime += self.waitdt
+
+            newbytes = self.in_waiting
+            if newbytes:
+                answer += self.read(size=newbytes)
+                if terminator is not None and terminator in answer:
+                    break
+            elif answer and terminator is None:
+                break
         else:
-            delim = ''
-            sleeptime = 1
+            if not self.quiet:
+                print(f'Breaking out of waiting for answer on serial after {self.maxwait} seconds!!!')
 
-        thispollcmd = (thispollcmd+delim).encode(self.codec)
-        pollcmd = b'CS/R/' + bytes(thispollcmd)+b'\r\n'
-        written = self.write(pollcmd)
-        #self.flush()
-        # according to manual there is a guarantee that the parsivel answers within 500 ms
-        # so we wait here to ensure the buffer is full
-        time.sleep(sleeptime)
-        self.polled = True
-        while self.in_waiting == 0 or self.waittime <= sleeptime:
+        return answer
 
-            time.sleep(self.waitdt)
-            self.waittime += self.waitdt
+    def pollcode(self, code):
+        """
+        Ask for the current value of a single code (CS/R), as string.
+        """
+        code = f'{int(code):02d}'
+        delim = ';' if int(code) >= 90 else ''
+        return self._exchange(f'CS/R/{code}{delim}\r\n'.encode(self.codec)).decode(self.codec)
 
-            if self.waittime > self.maxwait:
-                if not self.quiet:
-                    print(f'Breaking out of waiting for answer on serial as no data arrived after {self.maxwait} seconts!!!')
-                break
+    def pollcodes(self, codes):
+        """
+        Values of several codes, all from one CS/PA telegram.
 
-        answer = ''
-        if self.in_waiting > 0:
-            answer = self.read_until() #size=self.in_waiting)
-            answer = answer.decode(self.codec)
-        self.flush()
-        self.polled = False
+        Values are parsed like the sampled ones (see telegramfields), values
+        that fail to parse stay strings. Codes missing from the telegram
+        are asked for one by one with pollcode.
 
-        return answer
+        Returns
+        -------
+        values : dict
+            code (two digit string) -> value.
+
+        """
+        record = splittelegram(self._exchange(self.pollcmd, b'\x03'), self.codec)
+
+        values = {}
+        for code in codes:
+            code = f'{int(code):02d}'
+            value = record[code] if code in record else self.pollcode(code).strip().rstrip(';')
+
+            parser = telegramfields.get(code, telegramfield(code)).parser or _parsestring
+            try:
+                values[code] = parser(value)
+            except ValueError:
+                values[code] = value
+        return values
 
     def help(self):
-        if not self.isOpen():
-            self.open()
-            time.sleep(1)
+        print(self._exchange(b'CS/?\r\n', None).decode(self.codec))
 
-        self.flush()
-        self.clearbuffer()
-        pollcmd = b'CS/?\r\n'
-        written = self.write(pollcmd)
-        self.flush()
-        # according to manual there is a guarantee that the parsivel answers within 500 ms
-        # so we wait here to ensure the buffer is full
-        time.sleep(1)
-        while self.in_waiting == 0 or self.waittime <= 0.5:
+    def getconfig(self, refresh=False):
+        """
+        The configuration of the parsivel (CS/L) as dict of its "name: value" lines.
 
-            time.sleep(self.waitdt)
-            self.waittime += self.waitdt
+        The answer is cached until refresh or until a set command changes
+        the configuration.
+        """
+        if self.deviceconfig is not None and not refresh:
+            return self.deviceconfig
 
-            if self.waittime > self.maxwait:
-                if not self.quiet:
-                    print(f'Breaking out of waiting for answer on serial as no data arrived after {self.maxwait} seconts!!!')
-                break
+        answer = self._exchange(b'CS/L\r', None).decode(self.codec)
+        if not self.quiet:
+            print(answer)
 
-        answer = ''
-        if self.in_waiting > 0:
-            answer = self.read(size=self.in_waiting)
-            answer = answer.decode(self.codec)
+        config = {}
+        for line in answer.splitlines():
+            key, sep, value = line.partition(':')
+            if not sep or not key.strip():
+                continue
+            value = value.strip()
+            try:
+                value = _parsenumber(value)
+            except ValueError:
+                pass
+            config[key.strip()] = value
 
-        print(answer)
+        # an empty answer is not worth caching
+        self.deviceconfig = config or None
+        return config
 
+    def setinterval(self, seconds):
+        # measuring interval of the parsivel, so every telegram covers one samplinginterval
+        answer = self._exchange(f'CS/I/{int(seconds)}\r'.encode(self.codec)).decode(self.codec)
+        self.deviceconfig = None
+        if not self.quiet:
+            print(f'Answer to setinterval ({seconds}) from parsivel was', answer)
+        return answer.strip()
 
-    def getconfig(self):
-        if not self.isOpen():
-            self.open()
-            time.sleep(1)
+    def isprecipitating(self):
+        """
+        Whether the latest record shows precipitation (see eventintensity, eventparticles).
+        """
+        def latest(code):
+            values = self.data.get(code)
+            if not values or not isinstance(values[-1], (int, float)):
+                return 0
+            return values[-1]
 
-        self.clearbuffer()
-        pollcmd = b'CS/L\r' 
-        written = self.write(pollcmd)
-        # according to manual there is a guarantee that the parsivel answers within 500 ms
-        # so we wait here to ensure the buffer is full
-        time.sleep(0.5)
-        while self.in_waiting == 0 or self.waittime <= 0.5:
+        return (latest('01') >= self.eventintensity
+                or latest('11') >= self.eventparticles
+                or latest('03') > 0 or latest('04') > 0)
 
-            time.sleep(self.waitdt)
-            self.waittime += self.waitdt
+    def adaptinterval(self):
+        """
+        Switch between dryinterval and eventinterval after the latest record.
 
-            if self.waittime > self.maxwait:
-                if not self.quiet:
-                    print(f'Breaking out of waiting for answer on serial as no data arrived after {self.maxwait} seconts!!!')
-                break
+        Precipitation switches to eventinterval at once, back to dryinterval
+        only after eventhold seconds without, so a short break in an event
+        does not make the cadence flip back and forth. The interval of the
+        parsivel is set as well, so time_bnds and interval follow the cadence.
 
-        answer = ''
-        if self.in_waiting > 0:
-            answer = self.read(size=self.in_waiting)
-            answer = answer.decode(self.codec)
-            #answer = answer.split('\r\n')
+        Returns
+        -------
+        switched : bool
+            Whether the sampling interval has changed.
 
-        print(answer)
-        return answer
+        """
+        if not self.data['-1']:
+            return False
+
+        now = self.data['-1'][-1]
+        if self.isprecipitating():
+            self.lastprecipitation = now
+
+        event = self.lastprecipitation is not None and now - self.lastprecipitation < self.eventhold
+        interval = self.eventinterval if event else self.dryinterval
+        if interval == self.samplinginterval:
+            return False
+
+        print(f'Switching to {"event" if event else "dry"} sampling every {interval} seconds')
+        self.setinterval(interval)
+        self.samplinginterval = interval
+        return True
 
     def poll(self):
         if not self.isOpen():
@@ -449,7 +1592,7 @@ class parsivel_moxa(serial.Serial):
 
     def cleardata(self):
         # cleanup data dict after we've written out everything usually
-        self.data = {'-1': []}
+        self.data = {'-1': [], '-2': [], '-5': []}
 
     def clear(self):
         self.clearbuffer()
@@ -528,33 +1671,114 @@ class parsivel_moxa(serial.Serial):
             scaling = 1
         return dropletsizes / scaling, np.asarray(dropletwidths) / scaling, np.asarray(raw_dropletwidths) / scaling
 
-    # max sampling time in seconds (to be restarted by cronjob
+    # max sampling time in seconds, negative values sample until stopped
     def sample(self, writeoutfreq=None):
         self.setup()
 
         if writeoutfreq is None:
-            writeoutfreq = self.samplinginterval
-
-        if writeoutfreq % self.samplinginterval != 0:
-            print(f'Writoutfreq has been adjusted to be the lower multiple of the samplinginterval {self.samplinginterval}')
-            writeoutfreq = (writeoutfreq // self.samplinginterval) * self.samplinginterval
+            writeoutfreq = self.writeoutfreq
 
-        parsivel.reset_input_buffer()
+        self.reset_input_buffer()
         time.sleep(1)
 
         curdt = 0
+        nextwrite = 0
+        stationchecked = False
+        self.running = True
         try:
-            while curdt <= self.maxsampling or self.maxsampling <0:
-                parsivel.getparsiveldata()
-                #if curdt % 60 == 0:
-                if curdt % writeoutfreq == 0:
-                    parsivel.write2file()
+            while self.running and (curdt <= self.maxsampling or self.maxsampling < 0):
+                if self.reloadrequested:
+                    self.reloadconfig()
+
+                # (re)evaluate here as a reload may change the sampling interval
+                thiswriteoutfreq = self._writeoutfreq(writeoutfreq)
+
+                try:
+                    self.getparsiveldata()
+                    if not stationchecked:
+                        self.checkstationname()
+                        stationchecked = True
+                    if self.adaptive:
+                        self.adaptinterval()
+
+                    if self.clockisoff():
+                        self.syncclock()
+                except (serial.SerialException, OSError) as e:
+                    # keep everything buffered and continue once the port is back
+                    print(f'Issue with serial connection encountered ({e}), reconnecting...')
+                    self.reconnect()
+                    # the sensor may have been power cycled
+                    stationchecked = False
+                    continue
+
+                if curdt >= nextwrite:
+                    self.write2file()
+                    nextwrite = curdt + thiswriteoutfreq
                 time.sleep(self.samplinginterval)
                 curdt += self.samplinginterval
         except serial.SerialException:
             print('Issue with serial connection encounted, rerun...')
         except KeyboardInterrupt:
             print('Sampling interrupted.')
+        finally:
+            self.running = False
+            # do not lose what has been sampled since the last write
+            if self.data['-1'] or self.pending:
+                self.nextwriteattempt.clear()
+                self.write2file()
+            # whatever could not be written is picked up by the next run
+            self.spill()
+            self.closewriters()
+            if self.liveserver is not None:
+                self.liveserver.close()
+                self.liveserver = None
+
+    def reconnect(self):
+        """
+        Reopen the serial port with exponential backoff until it works or sampling stops.
+
+        Buffered records are kept, the gap until the next record is written
+        as time_gap. Only the input buffer is reset, station name and clock
+        are checked against the following telegrams as usual.
+        """
+        self.gapstart = self.lastrecordtime
+        self.clearbuffer()
+        self.polled = False
+        self.waittime = 0
+
+        delay = self.reconnectdelay
+        while self.running:
+            try:
+                self.close()
+            except (serial.SerialException, OSError):
+                pass
+
+            time.sleep(delay)
+            try:
+                self.open()
+                self.reset_input_buffer()
+            except (serial.SerialException, OSError) as e:
+                delay = min(2 * delay, self.maxreconnectdelay)
+                if not self.quiet:
+                    print(f'Reopening {self.port} failed ({e}), retrying in {delay} seconds')
+                continue
+
+            self.reconnects += 1
+            print(f'Reconnected to {self.port}')
+            return True
+
+        return False
+
+    def _writeoutfreq(self, writeoutfreq=None):
+        if writeoutfreq is None:
+            writeoutfreq = self.writeoutfreq or self.samplinginterval
+
+        if writeoutfreq % self.samplinginterval != 0:
+            writeoutfreq = max(writeoutfreq // self.samplinginterval, 1) * self.samplinginterval
+            if not self.quiet:
+                print(f'Writoutfreq has been adjusted to be the lower multiple of the samplinginterval {self.samplinginterval}')
+
+        return writeoutfreq
 
     def getparsiveldata(self):
         if not self.isOpen():
@@ -583,8 +1807,10 @@ class parsivel_moxa(serial.Serial):
 
             # since we check after the time.sleep we can assume if there is nothing new that we are done
             if curbytes == self.in_waiting and curbytes > 1:
+                # take along what is still waiting, otherwise the record is cut
+                self.buffer += self.read(size=self.in_waiting)
                 if not self.quiet:
-                    print(f'Breaking out of waiting for answer on serial as no new data has arrived after one more time step of {self.waitdr} after {self.waittime}!')
+                    print(f'Breaking out of waiting for answer on serial as no new data has arrived after one more time step of {self.waitdt} after {self.waittime}!')
                 break
         else:
             if len(self.buffer) == 0:
@@ -603,61 +1829,77 @@ class parsivel_moxa(serial.Serial):
 
         self.polled = False
 
-        # convert to sensible string
-        record = self.buffer.strip(b'\x03').decode(self.codec).strip()
-        # get different fields into list
-        record = record.split('\r\n')
-        # split into measurement value key and measurement value
-        # the default return is CODE (2 Letters): data (until prev. removed \r\n
-        record = {i[:2]: i[3:].rstrip(';').strip() for i in record[1:]}
+        self.parsetelegram(self.buffer, now)
+
+        # cleanup buffer
+        self.clearbuffer()
+
+    def parsetelegram(self, telegram, now):
+        """
+        Parse one CS/PA telegram (bytes) into self.data, now is the utc time it was polled.
+
+        Empty or partial telegrams (e.g. right after a reconnect) are skipped,
+        so all codes stay aligned with the timestamps. A telegram is partial
+        if it lacks the end of text or date/time, or if one of its spectra
+        cannot be parsed into its shape (cut or garbled on the line).
+
+        Returns
+        -------
+        success : bool
+            Whether the telegram was complete and has been added.
+
+        """
+        record = {}
+        if telegram.rstrip().endswith(b'\x03'):
+            try:
+                record = splittelegram(telegram, self.codec)
+            except UnicodeDecodeError:
+                pass
+
+        complete = '21' in record and '20' in record
 
+        parsed = {}
         for key, value in sorted(record.items()):
+            field = telegramfields.get(key, telegramfield(key))
             # maintenance codes
-            if key in ['94', '95', '96', '97', '98', '99']:
+            if field.parser is None:
                 continue
 
+            parser = field.parser
+            if key == '93' and self.sparse:
+                parser = _parsesparsespectrum
+
+            try:
+                value = parser(value)
+            except ValueError:
+                # a spectrum that does not parse has been cut or garbled
+                if field.shape:
+                    complete = False
+                    break
+                # neither float nor integer, maybe a weather code, like wawa
+                print(f'Conversion failed for {value}, based on {key}')
+
+            if isinstance(value, np.ndarray) and value.shape != field.shape:
+                complete = False
+                break
+            parsed[key] = value
+
+        if not complete:
+            print(f'Skipping incomplete telegram of {len(telegram)} bytes')
+            # the missed record counts as a gap
+            if self.gapstart is None:
+                self.gapstart = self.lastrecordtime
+            return False
+
+        for key, value in parsed.items():
             # build up the dict to hold the available data
             if key not in self.data:
                 self.data[key] = []
-
-            # date, time, software versions that should not be converted
-            # as well as synop codes, sensor date/time and measuring start 
-            # as we handle these ourselves
-            if key in ['20', '21', '14', '15', '05', '06', '19', '21', '22']:
-                pass
-
-            # spectra data
-            elif key in ['90', '91',  '93']:
-                value = value.replace('000','')
-
-                if value.count(';') == len(value):
-                    value = np.zeros((32, 32))
-                else:
-                    # spectra numbers are int
-                    if key in ['93']:
-                        value = [int(i) if i else 0 for i in value.split(';')]
-                    # others are float
-                    elif key in ['90', '91']:
-                        value = [float(i) if i else 0 for i in value.split(';')]
-
-                    value = np.asarray(value)
-                    if key in ['93']:
-                        value = value.reshape(32, 32)
-            else:
-                # float
-                if '.' in value and value.count('.') == 1:
-                    value = float(value)
-                else:
-                    # maybe integer?
-                    try:
-                        value = int(value)
-                    # neither float nor integer, maybe a weather code, like wawa
-                    except ValueError:
-                        print(f'Conversion to int failed for {value}, based on {key}')
-                        pass
-
             self.data[key] += [value]
 
+        # keep track of the sensor clock before it gets replaced
+        self.data['-2'] += [self.updateclock(self.data['21'][-1], self.data['20'][-1], now)]
+
         # replace sensor time with system time
         # 21 = date, 20 = time
         self.data['21'][-1] = now.strftime('%d.%m.%Y')
@@ -666,23 +1908,366 @@ class parsivel_moxa(serial.Serial):
         # keep unix time seperate
         self.data['-1'] += [datetime.datetime.timestamp(now)]
 
-        # cleanup buffer
-        self.clearbuffer()
+        # seconds not covered by records since the last one before a reconnect
+        gap = 0
+        if self.gapstart is not None:
+            gap = max(self.data['-1'][-1] - self.gapstart - self.samplinginterval, 0)
+            self.gapstart = None
+        self.data['-5'] += [gap]
+        self.lastrecordtime = self.data['-1'][-1]
+
+        if self.liveserver is not None:
+            # best effort, a frame that cannot be built must not stop sampling
+            try:
+                self.publish()
+            except Exception as e:
+                print(f'Publishing the record of {now} failed, skipping it: {e}')
+
+        return True
+
+    def startliveserver(self, address, **kwargs):
+        """
+        Publish every record to subscribers on a unix socket (path) or TCP (host:port).
 
-    def write2file(self, *args, **kwargs):
-        self.write2asdofile(*args, **kwargs)
-        self.write2ncfile(*args, **kwargs)
-        self.clear()
+        Keyword arguments are passed on to parsivel_liveserver.
+        """
+        if self.liveserver is not None:
+            self.liveserver.close()
+
+        self.liveserver = parsivel_liveserver(address, quiet=self.quiet, **kwargs)
+        self.liveserver.start()
+        return self.liveserver
+
+    def publish(self):
+        # the last record, numeric scalars and the spectrum only
+        scalars = {}
+        for key, values in self.data.items():
+            if len(key) == 2 and key not in ['-1', '93'] and isinstance(values[-1], (int, float, np.number)):
+                scalars[key] = float(values[-1])
+
+        spectrum = self.data['93'][-1] if self.data.get('93') else None
+        # a spectrum that could not be parsed stays a string, leave it out
+        if not isinstance(spectrum, (np.ndarray, sparsespectrum)):
+            spectrum = None
+        self.liveserver.publish(encodeframe(self.data['-1'][-1], scalars, spectrum))
+
+    def qcmasks(self):
+        """
+        Return the boolean mask of plausible bins in the layout of data_raw.
+
+        Bins are kept if their center velocity is within qcvdtolerance of
+        the terminal fall velocity of raindrops after Atlas et al. (1973),
+        v(D) = 9.65 - 10.3 exp(-0.6 D), which removes splashing and margin
+        fallers. The two smallest diameter classes are never filled by the
+        parsivel and are masked as well. The mask is only built once.
+
+        Returns
+        -------
+        qcmask : array of bool
+            Shape (32, 32) as (velocity, diameter), True for plausible bins.
+            In telegram 93 the diameter varies fastest, so reshaping it to
+            (32, 32) puts the velocity classes along the first axis.
+
+        """
+        if self.qcmask is not None:
+            return self.qcmask
+
+        diameters = self.diameter_classes(asmeters=False)[0]
+        velocities = self.velocity_classes()[0]
+
+        vterminal = 9.65 - 10.3 * np.exp(-0.6 * diameters)
+        deviation = np.abs(velocities[:, np.newaxis] - vterminal[np.newaxis, :])
+        qcmask = deviation <= self.qcvdtolerance * np.abs(vterminal[np.newaxis, :])
+        qcmask[:, :2] = False
+
+        self.qcmask = qcmask
+        return self.qcmask
+
+    def qualitycontrol(self):
+        """
+        Apply the velocity/diameter filter and QC checks to all buffered records.
+
+        Works on the whole batch at once and adds -3 (qc_flag) and
+        -4 (data_filtered) to self.data. The flag is a bitmask of
+            1: sum of 93 differs from 11 by more than qcparticletolerance
+            2: 18 state_sensor is not 0
+            4: 25 error_code is not 0
+            8: the filter removed more than qcmaxfiltered of the particles
+
+        Batches whose columns do not line up with the timestamps (e.g. after a
+        lost answer) are left without QC rather than flagged on wrong records.
+        """
+        nrecords = len(self.data['-1'])
+        if not nrecords or '93' not in self.data:
+            return
+
+        lengths = {i: len(self.data[i]) for i in ('93', '11', '18', '25') if i in self.data}
+        if any(i != nrecords for i in lengths.values()):
+            print(f'Skipping QC, column lengths {lengths} do not match {nrecords} records')
+            return
+
+        spectra = todense(self.data['93'])
+        filtered = spectra * self.qcmasks()
+
+        total = spectra.sum(axis=(1, 2))
+        nparticles = np.asarray(self.data.get('11', total), dtype=float)
+        state = np.asarray(self.data.get('18', np.zeros(nrecords)), dtype=float)
+        error = np.asarray(self.data.get('25', np.zeros(nrecords)), dtype=float)
+
+        flags = np.zeros(nrecords, dtype=int)
+        flags |= (np.abs(total - nparticles) > self.qcparticletolerance * nparticles) * 1
+        flags |= (state != 0) * 2
+        flags |= (error != 0) * 4
+        flags |= (total - filtered.sum(axis=(1, 2)) > self.qcmaxfiltered * total) * 8
+
+        self.data['-3'] = list(flags)
+        # in sparse mode the filtered spectra must not take up more memory than 93
+        self.data['-4'] = tosparse(filtered) if self.sparse else list(filtered)
+
+    def setwriters(self, formats, **kwargs):
+        """
+        Select the output backends by name (nc, asdo, parquet, zarr).
+
+        Keyword arguments are passed on to the writers, e.g. intosubdirs.
+        """
+        unknown = [i for i in formats if i not in writerbackends]
+        assert not unknown, f'Unknown output format(s) {unknown}, use {list(writerbackends)}'
+
+        self.closewriters()
+        self.outputformats = list(formats)
+        self.writers = [writerbackends[i](self, **kwargs) for i in self.outputformats]
+
+    def closewriters(self):
+        for writer in self.writers:
+            writer.close()
+
+    def opencatalog(self, path=None):
+        """
+        Keep a parsivel_catalog of all written files, default parsivel_catalog.sqlite in outpath.
+        """
+        if self.catalog is not None:
+            self.catalog.close()
+        if path is None:
+            path = os.path.join(self.outpath, 'parsivel_catalog.sqlite')
+        self.catalog = parsivel_catalog(path)
+
+    def write2file(self):
+        """
+        Queue the buffered records for all writers and write out what is pending.
+
+        Batches that could not be written stay queued (only for the writers
+        that failed) and are retried with increasing delay, per writer, so a
+        broken writer does not hold up the others. Beyond
+        maxbufferbytes, the oldest batches are spilled to the spool
+        directory and drained from there once the writers recover.
+        """
+        if self.data['-1']:
+            if self.qc:
+                # QC only annotates the records, it must never keep them from being written
+                try:
+                    self.qualitycontrol()
+                except Exception as e:
+                    print(f'Quality control of {len(self.data["-1"])} records failed: {e}')
+                    self.data.pop('-3', None)
+                    self.data.pop('-4', None)
+
+            self.pending.append([self.data, [i.name for i in self.writers], {}])
+            self.clear()
+
+        self.drain()
+
+        self.spill(self.maxbufferbytes)
+        self.updatemetrics()
+
+    def drain(self):
+        # oldest first, spooled batches are always older than those in memory.
+        # Each writer goes through the batches in order and stops at its first
+        # failure (or while backing off), the others carry on past it.
+        writers = {i.name: i for i in self.writers}
+        now = time.time()
+        blocked = {i for i in writers if now < self.nextwriteattempt.get(i, 0)}
+
+        for spoolfile in self._spoolfiles():
+            if blocked and blocked >= set(writers):
+                break
+            # only load what some writer can take now
+            if spoolfile in self.spoolpending and self.spoolpending[spoolfile] <= blocked:
+                continue
+            with gzip.open(spoolfile, 'rb') as fo:
+                batch = pickle.load(fo)
+            # spooled before attempts were counted
+            if len(batch) < 3:
+                batch.append({})
+
+            attempts = dict(batch[2])
+            pending = self._writebatch(batch[0], batch[1], batch[2], writers, blocked)
+            if pending:
+                # still pending for some writers, keep what remains
+                if pending != batch[1] or attempts != batch[2]:
+                    batch[1] = pending
+                    self._dumpspoolfile(spoolfile, batch)
+                self.spoolpending[spoolfile] = set(pending)
+                continue
+
+            os.remove(spoolfile)
+            self.spoolpending.pop(spoolfile, None)
+            self.metrics['drained_batches'] += 1
+
+        for batch in self.pending:
+            if blocked and blocked >= set(writers):
+                break
+            batch[1] = self._writebatch(batch[0], batch[1], batch[2], writers, blocked)
+        self.pending = collections.deque(i for i in self.pending if i[1])
+
+        return not self.pending and not self._spoolfiles()
+
+    def _writebatch(self, data, pending, attempts, writers, blocked):
+        # returns the names of the writers the batch is still pending for,
+        # writers that fail are added to blocked, attempts counts the failures
+        # that are likely caused by the data
+        remaining = []
+        for name in pending:
+            # writers that have been removed meanwhile are skipped
+            if name not in writers:
+                continue
+            if name in blocked:
+                remaining += [name]
+                continue
+            try:
+                writers[name].write(data)
+            except Exception as e:
+                self.metrics['write_failures'] += 1
+                # an OSError (disk full, share gone) usually passes, retrying bad data does not
+                if not isinstance(e, OSError):
+                    attempts[name] = attempts.get(name, 0) + 1
+                    if attempts[name] >= self.maxwriteattempts:
+                        self._deadletter(data, name, e)
+                        continue
+
+                print(f'Writing {len(data["-1"])} records with {name} failed, keeping them: {e}')
+                remaining += [name]
+                self.writebackoff[name] = min(max(2 * self.writebackoff.get(name, 0),
+                                                  self.samplinginterval),
+                                              self.maxwritebackoff)
+                self.nextwriteattempt[name] = time.time() + self.writebackoff[name]
+                blocked.add(name)
+                continue
+
+            self.writebackoff.pop(name, None)
+
+            if self.catalog is not None:
+                # the data are written, a broken catalog must not requeue them
+                try:
+                    self.catalog.addbatch(writers[name], data)
+                except Exception as e:
+                    print(f'Adding {len(data["-1"])} records of {name} to the catalog failed: {e}')
+
+        return remaining
+
+    def _deadletter(self, data, name, error):
+        # set aside for inspection, as a spool file pending for writer name only
+        deadletterfile = os.path.join(self._spooldir(), 'deadletter',
+                                      f'{name}_{data["-1"][0]:.0f}.pkl.gz')
+        try:
+            os.makedirs(os.path.dirname(deadletterfile), exist_ok=True)
+            self._dumpspoolfile(deadletterfile, [data, [name], {}])
+            print(f'Writing {len(data["-1"])} records with {name} failed {self.maxwriteattempts} '
+                  f'times ({error}), moved them to {deadletterfile}')
+        except OSError as e:
+            print(f'Moving {len(data["-1"])} records of {name} to the dead letters failed, '
+                  f'dropping them: {e}')
+        self.metrics['deadletter_batches'] += 1
+
+    def _batchbytes(self, data):
+        nbytes = 0
+        for values in data.values():
+            for value in values:
+                if isinstance(value, sparsespectrum):
+                    nbytes += value.index.nbytes + value.count.nbytes
+                elif isinstance(value, np.ndarray):
+                    nbytes += value.nbytes
+                else:
+                    nbytes += sys.getsizeof(value)
+        return nbytes
+
+    def _spooldir(self):
+        if self.spoolpath is None:
+            return os.path.join(self.outpath, '.spool')
+        return self.spoolpath
+
+    def _spoolfiles(self):
+        # the counter in the name keeps them in order
+        return sorted(glob.glob(os.path.join(self._spooldir(), 'batch_*.pkl.gz')))
+
+    def _dumpspoolfile(self, spoolfile, batch):
+        # write next to it and move, so a crash never leaves a partial batch
+        with gzip.open(spoolfile + '.tmp', 'wb', compresslevel=1) as fo:
+            pickle.dump(batch, fo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(spoolfile + '.tmp', spoolfile)
+
+    def spill(self, maxbytes=0):
+        """
+        Move the oldest queued batches to disk until at most maxbytes remain in memory.
+        """
+        batchbytes = [self._batchbytes(i[0]) for i in self.pending]
+
+        while self.pending and sum(batchbytes) > maxbytes:
+            batch = self.pending.popleft()
+            nbytes = batchbytes.pop(0)
+            try:
+                os.makedirs(self._spooldir(), exist_ok=True)
+                # continue after batches spilled by an earlier run
+                if not self.spoolcounter and self._spoolfiles():
+                    self.spoolcounter = int(self._spoolfiles()[-1].split('_')[-1][:-7]) + 1
+                spoolfile = os.path.join(self._spooldir(), f'batch_{self.spoolcounter:012d}.pkl.gz')
+                self._dumpspoolfile(spoolfile, batch)
+                self.spoolpending[spoolfile] = set(batch[1])
+                self.spoolcounter += 1
+            except OSError as e:
+                # better losing the oldest batch than everything to the OOM killer
+                print(f'Spilling {len(batch[0]["-1"])} records failed, dropping them: {e}')
+                self.metrics['dropped_batches'] += 1
+                continue
+
+            self.metrics['spilled_bytes'] += nbytes
+            self.metrics['spilled_batches'] += 1
+
+        spoolfiles = self._spoolfiles()
+        spoolbytes = [os.path.getsize(i) for i in spoolfiles]
+        while spoolfiles and sum(spoolbytes) > self.maxspoolbytes:
+            print(f'Spool exceeds {self.maxspoolbytes} bytes, dropping {spoolfiles[0]}')
+            self.spoolpending.pop(spoolfiles[0], None)
+            os.remove(spoolfiles.pop(0))
+            spoolbytes.pop(0)
+            self.metrics['dropped_batches'] += 1
+
+    def updatemetrics(self):
+        spoolfiles = self._spoolfiles()
+        self.metrics['buffered_bytes'] = sum([self._batchbytes(i[0]) for i in self.pending])
+        self.metrics['buffered_batches'] = len(self.pending)
+        self.metrics['spooled_bytes'] = sum([os.path.getsize(i) for i in spoolfiles])
+        self.metrics['spooled_batches'] = len(spoolfiles)
+        return self.metrics
 
     def _setupncfile(self):
+        nc = _netcdf4()
         if os.path.exists(self.ncfile):
             nchandle = nc.Dataset(self.ncfile, 'a', format='NETCDF3_CLASSIC')
-            return nchandle
+            if not hasattr(nchandle, 'Compacted'):
+                return nchandle
+
+            # compacted files have a fixed time dimension, so late records
+            # (e.g. drained from the spool) go into a file of their own
+            nchandle.close()
+            self.ncfile = self.ncfile[:-3] + '_late.nc'
+            return self._setupncfile()
 
         if not self.quiet:
-            print(f'Setting up {outfile}')
+            print(f'Setting up {self.ncfile}')
 
-        nchandle = nc.Dataset(self.ncfile, 'w', format='NETCDF3_CLASSIC')
+        # the ragged spectra need a second unlimited dimension
+        ncformat = 'NETCDF4' if self.sparse else 'NETCDF3_CLASSIC'
+        nchandle = nc.Dataset(self.ncfile, 'w', format=ncformat)
 
         nchandle.createDimension('time', None)
         nchandle.createDimension('diameter', 32)
@@ -727,13 +2312,6 @@ class parsivel_moxa(serial.Serial):
         setattr(datavar, 'units', 's')
         setattr(datavar, 'comment', 'Upper and lower bounds of measurement interval.')
 
-        datavar = nchandle.createVariable('interval', 'i', ('time',))
-        setattr(datavar, 'long_name', 'Length of measurement interval')
-        setattr(datavar, 'units', 's')
-        setattr(datavar, 'comment',
-                'Variable 09 - Sample interval between two data retrieval requests.')
-
-
         diameters  = self.diameter_classes()
         datavar = nchandle.createVariable('diameter', 'd', ('diameter',))
         setattr(datavar, 'long_name', 'Center diameter of precipitation particles')
@@ -774,131 +2352,85 @@ class parsivel_moxa(serial.Serial):
         datavar[:, :] = np.stack([np.cumsum(velocities[2][:-1]), np.cumsum(velocities[2][1:])]).T
 
 
-        datavar = nchandle.createVariable(
-            'data_raw', 'd', ('time', 'diameter', 'velocity',), fill_value=-999.)
-        setattr(datavar, 'long_name',
-                'Raw Data as a function of particle diameter and velocity')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment', 'Variable 93 - Raw data.')
-
-        datavar = nchandle.createVariable(
-            'number_concentration', 'd', ('time', 'diameter',), fill_value=-999.)
-        setattr(datavar, 'long_name', 'Number of particles per diameter class')
-        setattr(datavar, 'units', 'log10(m-3 mm-1)')
-        setattr(datavar, 'comment', 'Variable 90 - Field N (d)')
-
-        datavar = nchandle.createVariable(
-            'fall_velocity', 'd', ('time', 'diameter',), fill_value=-999.)
-        setattr(datavar, 'long_name', 'Average velocity of each diameter class')
-        setattr(datavar, 'units', 'm s-1')
-        setattr(datavar, 'comment', 'Variable 91 - Field v (d)')
+        # everything along time comes from the telegram registry
+        for field in telegramfields.values():
+            if field.ncname is None:
+                continue
 
-        datavar = nchandle.createVariable('n_particles', 'i', ('time',))
-        setattr(datavar, 'long_name', 'Number of particles in time interval')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment', 'Variable 11 - Number of detected particles')
+            if len(field.shape) == 2:
+                datavar = self._createspectrumvariable(nchandle, field)
+            else:
+                dims = ('time', 'diameter')[:len(field.shape) + 1]
+                datavar = nchandle.createVariable(field.ncname, field.dtype, dims,
+                                                  fill_value=field.fill_value)
+            datavar.setncatts(field.ncattrs)
 
-        datavar = nchandle.createVariable(
-            'rainfall_rate', 'd', ('time',), fill_value=-999.)
-        setattr(datavar, 'standard_name', 'rainfall_rate')
-        setattr(datavar, 'long_name', 'Precipitation rate')
-        setattr(datavar, 'units', 'm s-1')
-        setattr(datavar, 'comment', 'Variable 01 - Rain intensity (32 bit) 0000.000')
-
-        datavar = nchandle.createVariable(
-            'radar_reflectivity', 'd', ('time',), fill_value=-999)
-        setattr(datavar, 'standard_name', 'equivalent_reflectivity_factor')
-        setattr(datavar, 'long_name', 'equivalent radar reflectivity factor')
-        setattr(datavar, 'units', 'dBZ')
-        setattr(datavar, 'comment', 'Variable 07 - Radar reflectivity (32 bit).')
-
-        datavar = nchandle.createVariable('E_kin', 'd', ('time',), fill_value=-999.)
-        setattr(datavar, 'long_name', 'Kinetic energy of the hydrometeors')
-        setattr(datavar, 'units', 'kJ')
-        setattr(datavar, 'comment', 'Variable 24 - kinetic Energy of hydrometeors.')
-
-        datavar = nchandle.createVariable(
-            'visibility', 'i', ('time',), fill_value=-999)
-        setattr(datavar, 'long_name', 'Visibility range in precipitation after MOR')
-        setattr(datavar, 'units', 'm')
-        setattr(datavar, 'comment',
-                'Variable 08 - MOR visibility in the precipitation.')
+        setattr(nchandle.variables['data_filtered'], 'vd_tolerance', self.qcvdtolerance)
 
-        datavar = nchandle.createVariable(
-            'synop_WaWa', 'i', ('time',), fill_value=-999)
-        setattr(datavar, 'long_name', 'Synop Code WaWa')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment',
-                'Variable 03 - Weather code according to SYNOP wawa Table 4680.')
+        return nchandle
 
-        datavar = nchandle.createVariable(
-            'synop_WW', 'i', ('time',), fill_value=-999)
-        setattr(datavar, 'long_name', 'Synop Code WW')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment',
-                'Variable 04 - Weather code according to SYNOP ww Table 4677.')
 
-        datavar = nchandle.createVariable(
-            'T_sensor', 'i', ('time',), fill_value=-999)
-        setattr(datavar, 'long_name', 'Temperature in the sensor')
-        setattr(datavar, 'units', 'K')
-        setattr(datavar, 'comment', 'Variable 12 - Temperature in the Sensor')
+    def _createspectrumvariable(self, nchandle, field):
+        # dense (time, diameter, velocity) or, in sparse mode, a contiguous
+        # ragged array of the non-zero bins, see readspectra
+        name = field.ncname
+        if not self.sparse:
+            return nchandle.createVariable(
+                name, field.dtype, ('time', 'diameter', 'velocity',), fill_value=field.fill_value)
 
-        datavar = nchandle.createVariable('sig_laser', 'i', ('time',))
-        setattr(datavar, 'long_name', 'Signal amplitude of the laser')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment',
-                'Variable 10 - Signal ambplitude of the laser strip')
-
-        datavar = nchandle.createVariable('state_sensor', 'i', ('time',))
-        setattr(datavar, 'long_name', 'State of the Sensor')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment', 'Variable 18 - Sensor status:\n'\
-                                    '0: Everything is okay.\n' \
-                                    '1: Dirty but measurement possible.\n'\
-                                    '2: No measurement possile')
-
-        datavar = nchandle.createVariable('V_sensor', 'd', ('time',))
-        setattr(datavar, 'long_name', 'Sensor Voltage')
-        setattr(datavar, 'units', 'V')
-        setattr(datavar, 'comment', 'Variable 17 - Power supply voltage in the sensor.')
-
-        datavar = nchandle.createVariable('I_heating', 'd', ('time',))
-        setattr(datavar, 'long_name', 'Heating Current')
-        setattr(datavar, 'units', 'A')
-        setattr(datavar, 'comment', 'Variable 16 - Current through the heating system.')
-
-        datavar = nchandle.createVariable('error_code', 'i', ('time',))
-        setattr(datavar, 'long_name', 'Error Code')
-        setattr(datavar, 'units', '1')
-        setattr(datavar, 'comment', 'Variable 25 - Error code.')
+        nchandle.createDimension(name + '_sample', None)
 
-        return nchandle
+        datavar = nchandle.createVariable(name + '_count', 'i', ('time',))
+        setattr(datavar, 'long_name', f'Number of non-zero bins of {name} per record')
+        setattr(datavar, 'sample_dimension', name + '_sample')
+
+        datavar = nchandle.createVariable(name + '_index', 'i2', (name + '_sample',))
+        setattr(datavar, 'long_name', f'Flat (velocity, diameter) bin index of {name}')
+        setattr(datavar, 'comment', 'index = velocity class * 32 + diameter class, starting at 0, '
+                                    'as in telegram 93.')
 
+        return nchandle.createVariable(name, field.dtype, (name + '_sample',))
 
-    def write2ncfile(self, intosubdirs=True, ):
+    def _appendragged(self, nchandle, name, spectra, timesteps):
+        counts, index, values = toragged(spectra)
+        nchandle.variables[name + '_count'][timesteps] = counts
 
-        if self.data:
+        cursample = nchandle.dimensions[name + '_sample'].size
+        samples = slice(cursample, cursample + len(index))
+        nchandle.variables[name + '_index'][samples] = index
+        nchandle.variables[name][samples] = values
+
+    def _daypath(self, day, intosubdirs=True):
+        # the directory for files of a day (d.m.Y), Y/M/D below outpath if intosubdirs
+        if not self.outpath.endswith(os.sep):
+            self.outpath += os.sep
+
+        if intosubdirs:
+            ymd = day.split('.')[::-1]
+            ymd = [i + j for i, j in zip(['Y', 'M', 'D'], ymd)]
+            _outpath = self.outpath+os.sep.join(ymd)+os.sep
+        else:
+            _outpath = self.outpath
+
+        os.makedirs(_outpath, exist_ok=True)
+        return _outpath
+
+    def write2ncfile(self, intosubdirs=True, data=None):
+        # data defaults to everything buffered, but can be any batch of records
+        if data is None:
+            data = self.data
+
+        if data['-1']:
             pass
         else:
             if not self.quiet:
                 print('No data have been read yet. Call getparsiveldata() first.')
             return
 
-        if not self.outpath.endswith(os.sep):
-            self.outpath += os.sep
-
-        os.makedirs(self.outpath, exist_ok=True)
 
-        udays = sorted(list(set(self.data['21'])))
+        udays = sorted(list(set(data['21'])))
         for day in udays:
-            if intosubdirs:
-               ymd = day.split('.')[::-1]
-               ymd = [i + j for i, j in zip(['Y', 'M', 'D'], ymd)]
-               _outpath = self.outpath+os.sep.join(ymd)+os.sep
-               os.makedirs(_outpath, exist_ok=True)
-            else:
-                _outpath = self.outpath
+            _outpath = self._daypath(day, intosubdirs)
 
             # day has the format d.m.Y but we want the filename to be Ymd
             outfile = self.fileprefix +''.join(day.split('.')[::-1]) + '.nc'
@@ -906,31 +2438,51 @@ class parsivel_moxa(serial.Serial):
             nchandle = self._setupncfile()
             setattr(nchandle, 'Date', day)
 
-            index_of_day = [i[0] for i in enumerate(self.data['21']) if i[1] == day]
+            index_of_day = [i[0] for i in enumerate(data['21']) if i[1] == day]
 
             curtimestep = nchandle.dimensions['time'].size
+            # all records of the day are appended at once
+            timesteps = slice(curtimestep, curtimestep + len(index_of_day))
 
-            unixtime = ([self.data['-1'][i] for i in index_of_day])
-            nchandle.variables["time"][curtimestep] = (unixtime)
-            bnds = [[self.data['-1'][i] - int(self.data['09'][i]), self.data['-1'][i]] for i in index_of_day]
-            nchandle.variables['time_bnds'][curtimestep, :] = (bnds)
+            unixtime = ([data['-1'][i] for i in index_of_day])
+            nchandle.variables["time"][timesteps] = (unixtime)
+            bnds = [[data['-1'][i] - int(data['09'][i]), data['-1'][i]] for i in index_of_day]
+            nchandle.variables['time_bnds'][timesteps, :] = (bnds)
 
             varNames = nchandle.variables.keys()
 
             for ncvar in self.ncmapping:
+                # files started by an older version may lack newer variables
+                # and derived variables (e.g. qc) may not have been computed
+                if self.ncmapping[ncvar] not in nchandle.variables:
+                    continue
+                if ncvar not in data:
+                    # ragged records still need their (zero) count
+                    if self.ncmapping[ncvar] + '_count' in nchandle.variables:
+                        nchandle.variables[self.ncmapping[ncvar] + '_count'][timesteps] = 0
+                    continue
                 thisvar = nchandle.variables[self.ncmapping[ncvar]]
-                thisdata = [self.data[ncvar][i] for i in index_of_day]
+                thisdata = [data[ncvar][i] for i in index_of_day]
+
+                # the layout of the file decides, not the current mode
+                if self.ncmapping[ncvar] + '_count' in nchandle.variables:
+                    self._appendragged(nchandle, self.ncmapping[ncvar], thisdata, timesteps)
+                    continue
                 
+                # converted as one column instead of value by value
                 if ncvar in self.nctransformation:
-                    thisdata = [self.nctransformation[ncvar](i) for i in thisdata]
+                    thisdata = self.nctransformation[ncvar](np.asarray(thisdata, dtype=float))
 
                 if len(thisvar.shape) == 1:
-                    thisvar[curtimestep] = (thisdata)
+                    thisvar[timesteps] = (thisdata)
                 elif len(thisvar.shape) == 2:
-                    thisvar[curtimestep, :] = (thisdata)
+                    thisvar[timesteps, :] = (thisdata)
                 elif len(thisvar.shape) == 3:
-                    thisdata = np.asarray(thisdata).reshape(thisvar.shape[1:])
-                    thisvar[curtimestep, :, :] = (thisdata)
+                    thisdata = todense(thisdata, thisvar.shape[1:])
+                    thisvar[timesteps, :, :] = (thisdata)
+
+            if self.clockdrift is not None:
+                setattr(nchandle, 'Clock_drift', f'{self.clockdrift * 86400:.3f} s/day')
 
             nchandle.close()
             now = datetime.datetime.utcnow()
@@ -940,10 +2492,13 @@ class parsivel_moxa(serial.Serial):
         pass
 
     # order can be anything, but defaults to ASDO format, see header in below function
-    def write2asdofile(self, intosubdirs=True, varorder=[], header=[]):
+    def write2asdofile(self, intosubdirs=True, varorder=[], header=[], data=None):
         assert len(varorder) == len(header), 'Order of variables and header have to match'
 
-        if self.data:
+        if data is None:
+            data = self.data
+
+        if data['-1']:
             pass
         else:
             print('No data have been read yet. Call getparsiveldata() first.')
@@ -955,10 +2510,6 @@ class parsivel_moxa(serial.Serial):
         if header:
             self.csvheader = header
 
-        if not self.outpath.endswith(os.sep):
-            self.outpath += os.sep
-
-        os.makedirs(self.outpath, exist_ok=True)
         filemode = 'a'
 
         # examples ASDO file
@@ -975,16 +2526,10 @@ class parsivel_moxa(serial.Serial):
         #2,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,2,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,1,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,1,,,,,,,,,,,,
         #,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,
         #,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,,</SPECTRUM>
-        udays = sorted(list(set(self.data['21'])))
+        udays = sorted(list(set(data['21'])))
 
         for day in udays:
-            if intosubdirs:
-               ymd = day.split('.')[::-1]
-               ymd = [i + j for i, j in zip(['Y', 'M', 'D'], ymd)]
-               _outpath = self.outpath+os.sep.join(ymd)+os.sep
-               os.makedirs(_outpath, exist_ok=True)
-            else:
-                _outpath = self.outpath
+            _outpath = self._daypath(day, intosubdirs)
 
             # day has the format d.m.Y but we want the filename to be Ymd
             self.csvfile = self.fileprefix +''.join(day.split('.')[::-1]) + '.csv'
@@ -994,8 +2539,8 @@ class parsivel_moxa(serial.Serial):
             if os.path.exists(_outpath + self.csvfile):
                 writeheader = False
 
-            # maxtimesteps because self.data holds everything
-            ntimesteps = len(self.data['20'])
+            # maxtimesteps because data holds everything
+            ntimesteps = len(data['20'])
 
             with open(_outpath+self.csvfile, filemode) as fo:
 
@@ -1003,60 +2548,1283 @@ class parsivel_moxa(serial.Serial):
                      fo.write(','.join(self.csvheader))
                      fo.write('\n')
 
-                for timestep in range(ntimesteps):
-                    # skip if not the same day
-                    if self.data['21'][timestep] != day:
-                        continue
-                    for key in self.csvoutputorder:
-                        varrec = self.data[key][timestep]
-                        if key in '93':
-                            fo.write('<SPECTRUM>')
+                # only the records of this day
+                fo.write(self.asdolines(data, [i for i in range(ntimesteps) if data['21'][i] == day]))
 
-                        if key in ['90', '91', '93']:
-                            if not isinstance(varrec, str):
-                                varrec = ','.join([str(i) if i > 0 else '' for i in varrec.flatten()])
+            self.csvfiles = list(set(self.csvfiles+[self.csvfile]))
+            if not self.quiet:
+                print(f'Written {ntimesteps} records to {_outpath+self.csvfile} for {day}')
 
-                            if len(varrec) == varrec.count(','):
-                                varrec = 'ZERO'
+    def asdolines(self, data, index):
+        """
+        The ASDO csv lines (csvoutputorder, without header) of the records index of a batch.
+        """
+        lines = []
+        for timestep in index:
+            line = ''
+            for key in self.csvoutputorder:
+                varrec = data[key][timestep]
+                if key in '93':
+                    line += '<SPECTRUM>'
+
+                if isinstance(varrec, sparsespectrum):
+                    # only the non-zero bins have to be formatted
+                    spectrum = [''] * 1024
+                    for index, count in zip(varrec.index, varrec.count):
+                        spectrum[index] = str(count)
+                    varrec = ','.join(spectrum)
+
+                if telegramfields.get(key, telegramfield(key)).shape:
+                    if not isinstance(varrec, str):
+                        varrec = ','.join([str(i) if i > 0 else '' for i in varrec.flatten()])
+
+                    if len(varrec) == varrec.count(','):
+                        varrec = 'ZERO'
+
+                line += str(varrec)
+
+                if key in '93':
+                    line += '</SPECTRUM>'
+                else:
+                    line += ','
+
+            lines.append(line + '\n')
+        return ''.join(lines)
+
+class parsivel_bussensor(parsivel_moxa):
+    """
+    One addressed parsivel on a parsivel_bus.
+
+    It has its own data, outputs (outpath, writers, catalog), clock estimate
+    and station name, but no port of its own: all serial I/O goes through
+    the bus with commands addressed by the addresstemplate of the bus, so
+    the interactive and setup methods work as for a single parsivel.
+    """
+
+    def __init__(self, bus, address, **kwargs):
+        self.bus = bus
+        self.address = address
+        super().__init__(port=None, **kwargs)
+        self.samplinginterval = bus.samplinginterval
+        # the next scheduled poll and write out (unix time), set by the bus
+        self.nextpoll = 0
+        self.nextwrite = 0
+
+    def __del__(self):
+        # the port belongs to the bus
+        pass
 
-                        fo.write(str(varrec))
+    def open(self):
+        if not self.bus.isOpen():
+            self.bus.open()
 
-                        if key in '93':
-                            fo.write('</SPECTRUM>')
-                        else:
-                            fo.write( ',')
+    def close(self):
+        pass
 
-                    fo.write('\n')
-            self.csvfiles = list(set(self.csvfiles+[self.csvfile]))
+    def isOpen(self):
+        return self.bus.isOpen()
+
+    def flush(self):
+        self.bus.flush()
+
+    def reset_input_buffer(self):
+        self.bus.reset_input_buffer()
+
+    @property
+    def in_waiting(self):
+        return self.bus.in_waiting
+
+    def read(self, size=1):
+        return self.bus.read(size)
+
+    def read_until(self, expected=b'\n', size=None):
+        return self.bus.read_until(expected, size)
+
+    def write(self, data):
+        return self.bus.write(self.bus.addressed(self.address, data))
+
+
+class parsivel_bus(serial.Serial):
+    """
+    Several addressed parsivels on one RS-485 (2 wire) port.
+
+    The scheduler polls every sensor at its own samplinginterval, keeping
+    to a fixed schedule instead of sleeping a fixed time after each poll.
+    The response is read until its end of text (0x03), so the next sensor
+    is polled right away and the bus is only idle until the next sensor
+    is due. Every sensor writes its records to its own outputs.
+
+    addresstemplate turns a command into one for a single sensor and has
+    to match how the sensors are set up for bus operation.
+    """
+
+    def __init__(self, port='/dev/ttyUSB0', baudrate=57600,
+                 addresstemplate='{address}{command}', timeout=4,
+                 samplinginterval=10, quiet=True):
+        # the timeout bounds waiting for a whole response
+        super().__init__(port=port, baudrate=baudrate, timeout=timeout)
+        self.addresstemplate = addresstemplate
+        self.samplinginterval = samplinginterval
+        self.quiet = quiet
+        self.codec = 'utf-8'
+        self.sensors = []
+        self.maxsampling = -1
+        self.running = False
+        # backoff when reopening the port (seconds)
+        self.reconnectdelay = 1
+        self.maxreconnectdelay = 60
+        self.reconnects = 0
+        # set by fromconfig, reread on SIGHUP, outpath and cliargs take precedence over it
+        self.configfile = None
+        self.outpath = None
+        self.cliargs = {}
+        self.reloadrequested = False
+
+    @classmethod
+    def fromconfig(cls, configfile, port=None, outpath=None):
+        """
+        Create a bus and its sensors from a TOML/YAML config file (see loadconfig).
+
+        Every entry of sensors needs an address, its other keys override
+        those of the station section (outpath defaults to a directory per
+        stationname) and it may have its own ncmeta and live sections.
+        """
+        config = loadconfig(configfile)
+        bus = cls(port=port or config['serial'].get('port', '/dev/ttyUSB0'),
+                  baudrate=config['serial'].get('baudrate', 57600),
+                  samplinginterval=config['sampling'].get('samplinginterval', 10),
+                  quiet=config.get('quiet', True), **config['bus'])
+        bus.configfile = configfile
+        bus.outpath = outpath
+        bus.cliargs = {'port': port} if port is not None else {}
+
+        for address, sensorconfig in bus._sensorconfigs(config):
+            station = sensorconfig['station']
+            kwargs = {'ncmeta': sensorconfig['ncmeta']} if sensorconfig['ncmeta'] else {}
+            sensor = bus.addsensor(address, outpath=station['outpath'],
+                                   stationname=station['stationname'], quiet=bus.quiet, **kwargs)
+            sensor.applyconfig(sensorconfig, initial=True)
+        return bus
+
+    def _sensorconfigs(self, config):
+        # (address, config) of every sensor, with its own station, ncmeta and live sections
+        for entry in config['sensors']:
+            entry = dict(entry)
+            address = entry.pop('address')
+            # the port belongs to the bus
+            sensorconfig = dict(config, serial={},
+                                ncmeta={**config['ncmeta'], **entry.pop('ncmeta', {})},
+                                live=entry.pop('live', {}))
+            station = sensorconfig['station'] = {**config['station'], **entry}
+            station.setdefault('stationname', f'Sensor{address}')
+            station['outpath'] = entry.get('outpath') or os.path.join(
+                self.outpath or config['station'].get('outpath', './'), station['stationname'])
+            yield address, sensorconfig
+
+    def reloadconfig(self):
+        """
+        Reread the config file and apply it to the bus and every sensor.
+
+        Sensors are matched by address, adding or removing sensors as well
+        as changing the port requires a restart.
+        """
+        self.reloadrequested = False
+        if self.configfile is None:
+            return
+
+        try:
+            config = overrideconfig(loadconfig(self.configfile), self.cliargs)
+            sensorconfigs = dict(self._sensorconfigs(config))
+        except Exception as e:
+            print(f'Reloading {self.configfile} failed, keeping current config: {e}')
+            return
+
+        addresses = [i.address for i in self.sensors]
+        if set(sensorconfigs) != set(addresses):
+            print(f'Adding or removing sensors requires a restart, keeping {addresses}')
+
+        self.quiet = config.get('quiet', self.quiet)
+        self.addresstemplate = config['bus'].get('addresstemplate', self.addresstemplate)
+        # pyserial reconfigures an open port in place
+        self.timeout = config['bus'].get('timeout', self.timeout)
+        self.baudrate = config['serial'].get('baudrate', self.baudrate)
+        if config['serial'].get('port', self.port) != self.port:
+            print(f'Port change to {config["serial"]["port"]} requires a restart, keeping {self.port}')
+
+        for sensor in self.sensors:
+            if sensor.address not in sensorconfigs:
+                continue
+            try:
+                sensor.applyconfig(sensorconfigs[sensor.address])
+            except Exception as e:
+                print(f'Applying {self.configfile} to sensor {sensor.address} failed partly, continuing: {e}')
+        print(f'Reloaded config from {self.configfile}')
+
+    def addsensor(self, address, **kwargs):
+        """
+        Add a parsivel_bussensor, keyword arguments are passed on to parsivel_moxa.
+        """
+        sensor = parsivel_bussensor(self, address, **kwargs)
+        self.sensors.append(sensor)
+        return sensor
+
+    def addressed(self, address, command):
+        # command (bytes) for the sensor with address
+        return self.addresstemplate.format(address=address,
+                                           command=command.decode(self.codec)).encode(self.codec)
+
+    def pollsensor(self, sensor):
+        """
+        Poll one sensor and parse its telegram, without any fixed sleeps.
+
+        Returns
+        -------
+        success : bool
+            Whether a complete telegram arrived within timeout.
+
+        """
+        now = datetime.datetime.utcnow()
+        self.reset_input_buffer()
+        self.write(self.addressed(sensor.address, sensor.pollcmd))
+        telegram = self.read_until(b'\x03')
+
+        if not telegram.endswith(b'\x03'):
+            print(f'No complete telegram from sensor {sensor.address} ({sensor.stationname}) '
+                  f'within {self.timeout} seconds')
+            return False
+
+        return sensor.parsetelegram(telegram, now)
+
+    def run(self):
+        """
+        Sample indefinitely as a daemon.
+
+        SIGHUP rereads the config file between two polling rounds, SIGTERM
+        stops after writing out all sensors.
+        """
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._onsighup)
+        signal.signal(signal.SIGTERM, self._onsigterm)
+        self.maxsampling = -1
+        self.sample()
+
+    def _onsighup(self, signum, frame):
+        # only flag it, the reload happens between two polling rounds
+        self.reloadrequested = True
+
+    def _onsigterm(self, signum, frame):
+        self.running = False
+
+    def sample(self):
+        for sensor in self.sensors:
+            sensor.setup()
+        self.reset_input_buffer()
+
+        start = time.time()
+        for sensor in self.sensors:
+            sensor.nextpoll = start
+            sensor.nextwrite = start + sensor._writeoutfreq()
+        stationchecked = set()
+
+        self.running = True
+        try:
+            while self.running and (time.time() - start <= self.maxsampling or self.maxsampling < 0):
+                if self.reloadrequested:
+                    self.reloadconfig()
+
+                due = [i for i in self.sensors if i.nextpoll <= time.time()]
+                for sensor in sorted(due, key=lambda i: i.nextpoll):
+                    try:
+                        if self.pollsensor(sensor):
+                            if sensor.address not in stationchecked:
+                                sensor.checkstationname()
+                                stationchecked.add(sensor.address)
+                            if sensor.clockisoff():
+                                sensor.syncclock()
+                            if sensor.adaptive:
+                                sensor.adaptinterval()
+                    except (serial.SerialException, OSError) as e:
+                        print(f'Issue with serial connection encountered ({e}), reconnecting...')
+                        self.reconnect()
+                        stationchecked.clear()
+                        break
+
+                    # keep to the schedule, slots that have been missed entirely are skipped
+                    now = time.time()
+                    sensor.nextpoll += sensor.samplinginterval * max(
+                        np.ceil((now - sensor.nextpoll) / sensor.samplinginterval), 1)
+
+                    if now >= sensor.nextwrite:
+                        sensor.write2file()
+                        sensor.nextwrite = now + sensor._writeoutfreq()
+
+                # the bus is idle until the next sensor is due
+                wait = min(i.nextpoll for i in self.sensors) - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+        except KeyboardInterrupt:
+            print('Sampling interrupted.')
+        finally:
+            self.running = False
+            for sensor in self.sensors:
+                if sensor.data['-1'] or sensor.pending:
+                    sensor.nextwriteattempt.clear()
+                    sensor.write2file()
+                sensor.spill()
+                sensor.closewriters()
+                if sensor.liveserver is not None:
+                    sensor.liveserver.close()
+                    sensor.liveserver = None
+
+    def reconnect(self):
+        # like parsivel_moxa.reconnect, for all sensors on the port at once
+        for sensor in self.sensors:
+            sensor.gapstart = sensor.lastrecordtime
+
+        delay = self.reconnectdelay
+        while self.running:
+            try:
+                self.close()
+            except (serial.SerialException, OSError):
+                pass
+
+            time.sleep(delay)
+            try:
+                self.open()
+                self.reset_input_buffer()
+            except (serial.SerialException, OSError) as e:
+                delay = min(2 * delay, self.maxreconnectdelay)
+                if not self.quiet:
+                    print(f'Reopening {self.port} failed ({e}), retrying in {delay} seconds')
+                continue
+
+            self.reconnects += 1
+            print(f'Reconnected to {self.port}')
+            return True
+
+        return False
+
+
+class parsivel_writer:
+    """
+    Base of the output backends that write2file fans every batch out to.
+
+    A batch is a dict like parsivel_moxa.data, i.e. lists of values per
+    code that all have the same length as the unix time in '-1'.
+    """
+    # the name used in outputformats / the [output] config section
+    name = ''
+    # extension of the daily files (or directories)
+    suffix = ''
+
+    def __init__(self, parsivel, intosubdirs=True):
+        self.parsivel = parsivel
+        self.intosubdirs = intosubdirs
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        # backends holding files open finalize them here
+        pass
+
+    def _days(self, data):
+        # record indices per day (d.m.Y of code 21)
+        days = {}
+        for index, day in enumerate(data['21']):
+            days.setdefault(day, []).append(index)
+        return days
+
+    def _columns(self, data, index_of_day, spectra=False):
+        # ncmapping names and transformed values of either scalars or spectra
+        columns = {}
+        for code, name in self.parsivel.ncmapping.items():
+            if code not in data or not data[code]:
+                continue
+
+            values = [data[code][i] for i in index_of_day]
+            if isinstance(values[0], sparsespectrum):
+                values = todense(values)
+            values = np.asarray(values)
+
+            if code in self.parsivel.nctransformation:
+                values = self.parsivel.nctransformation[code](values.astype(float))
+            if (values.ndim > 1) == spectra:
+                columns[name] = values
+        return columns
+
+    def _outfile(self, day, suffix):
+        # day has the format d.m.Y but we want the filename to be Ymd
+        return (self.parsivel._daypath(day, self.intosubdirs)
+                + self.parsivel.fileprefix + ''.join(day.split('.')[::-1]) + suffix)
+
+    def outfiles(self, data):
+        # the files a written batch went to, as {path: record indices}
+        return {self._outfile(day, self.suffix): index_of_day
+                for day, index_of_day in self._days(data).items()}
+
+
+class parsivel_ncwriter(parsivel_writer):
+    name = 'nc'
+    suffix = '.nc'
+
+    def write(self, data):
+        self.parsivel.write2ncfile(intosubdirs=self.intosubdirs, data=data)
+
+    def outfiles(self, data):
+        # once a day is compacted, everything later goes into its _late.nc
+        outfiles = {}
+        for ncfile, index_of_day in super().outfiles(data).items():
+            if os.path.exists(ncfile[:-3] + '_late.nc'):
+                ncfile = ncfile[:-3] + '_late.nc'
+            outfiles[ncfile] = index_of_day
+        return outfiles
+
+
+class parsivel_asdowriter(parsivel_writer):
+    name = 'asdo'
+    suffix = '.csv'
+
+    def write(self, data):
+        self.parsivel.write2asdofile(intosubdirs=self.intosubdirs, data=data)
+
+
+class _gzipstream:
+    # one gzip member kept open, every write ends at a readable sync point
+    def __init__(self, fo, level):
+        self.fo = fo
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def write(self, data):
+        self.fo.write(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.fo.flush()
+
+    def finish(self):
+        self.fo.write(self.compressor.flush(zlib.Z_FINISH))
+        self.fo.flush()
+
+
+class _zstdstream:
+    # one zstd frame kept open, every write ends with a complete block
+    def __init__(self, fo, level):
+        import zstandard
+        self.fo = fo
+        self.flushblock = zstandard.FLUSH_BLOCK
+        self.flushframe = zstandard.FLUSH_FRAME
+        self.writer = zstandard.ZstdCompressor(level=level).stream_writer(fo, closefd=False)
+
+    def write(self, data):
+        self.writer.write(data)
+        self.writer.flush(self.flushblock)
+        self.fo.flush()
+
+    def finish(self):
+        self.writer.flush(self.flushframe)
+        self.fo.flush()
+
+
+class parsivel_asdogzwriter(parsivel_writer):
+    """
+    ASDO csv like asdo, but gzip compressed (parsivel_Ymd.csv.gz) through a
+    file and compressor that stay open for the day.
+
+    Every batch is compressed with the history of the day and sync flushed,
+    so the file is readable (e.g. by openasdofile, or zcat up to its
+    warning about the missing end) after every batch. The file of a day is
+    finalized (gzip trailer, synced and closed) once a later day is written,
+    or by close. A file left unfinished by a crash is recompressed when it
+    is reopened, later runs append members of their own.
+    """
+    name = 'asdogz'
+    suffix = '.csv.gz'
+    stream = _gzipstream
+
+    def __init__(self, parsivel, intosubdirs=True, level=6):
+        super().__init__(parsivel, intosubdirs=intosubdirs)
+        self.level = level
+        # open (file handle, compressor stream) by day (Ymd)
+        self.files = {}
+
+    def _open(self, outfile):
+        if os.path.exists(outfile) and os.path.getsize(outfile):
+            with _compressedreader(outfile) as fo:
+                text = fo.readall()
+                complete = fo.complete
+
+            if not complete:
+                # the last stream cannot be continued, rewrite what is readable as a new one
+                print(f'Recompressing {outfile}, it was not finished')
+                fo = open(outfile + '.tmp', 'wb')
+                stream = self.stream(fo, self.level)
+                text = text[:text.rfind(b'\n') + 1]
+                if text:
+                    stream.write(text)
+                os.fsync(fo.fileno())
+                os.replace(outfile + '.tmp', outfile)
+                return fo, stream
+
+        fo = open(outfile, 'ab')
+        return fo, self.stream(fo, self.level)
+
+    def write(self, data):
+        for day, index_of_day in self._days(data).items():
+            ymd = ''.join(day.split('.')[::-1])
+            if ymd not in self.files:
+                self.files[ymd] = self._open(self._outfile(day, self.suffix))
+            fo, stream = self.files[ymd]
+
+            text = ''
+            if fo.tell() == 0:
+                text = ','.join(self.parsivel.csvheader) + '\n'
+            text += self.parsivel.asdolines(data, index_of_day)
+            stream.write(text.encode(self.parsivel.codec))
+
+            if not self.parsivel.quiet:
+                print(f'Written {len(index_of_day)} records to {fo.name}')
+
+        # days before the latest one are complete
+        for ymd in sorted(self.files)[:-1]:
+            self.finalize(ymd)
+
+    def finalize(self, ymd):
+        fo, stream = self.files.pop(ymd)
+        stream.finish()
+        os.fsync(fo.fileno())
+        fo.close()
+
+    def close(self):
+        for ymd in list(self.files):
+            self.finalize(ymd)
+
+
+class parsivel_asdozstwriter(parsivel_asdogzwriter):
+    """
+    Like asdogz but as one zstd frame per day and run (parsivel_Ymd.csv.zst)
+    with a block flush per batch, requires zstandard.
+    """
+    name = 'asdozst'
+    suffix = '.csv.zst'
+    stream = _zstdstream
+
+    def __init__(self, parsivel, intosubdirs=True, level=3):
+        super().__init__(parsivel, intosubdirs=intosubdirs, level=level)
+
+    def _open(self, outfile):
+        # fail before the file is created
+        import zstandard
+        return super()._open(outfile)
+
+
+class parsivel_parquetwriter(parsivel_writer):
+    """
+    Scalars (no spectra) as parquet, requires pyarrow.
+
+    Every batch is written right away as a small file to _pending/ of a
+    daily dataset directory (parsivel_Ymd.parquet/), which readers of the
+    dataset ignore. Once partrecords records (an hour at the default
+    samplinginterval) are pending, once a later day is written, or by
+    close, they are rolled up into one part file. Every file is complete,
+    so a crash never leaves an unreadable one nor loses written batches;
+    pending files of an earlier run are rolled up with the next ones.
+    """
+    name = 'parquet'
+    suffix = '.parquet'
+
+    def __init__(self, parsivel, intosubdirs=True, partrecords=360):
+        super().__init__(parsivel, intosubdirs=intosubdirs)
+        self.partrecords = partrecords
+        # number of pending records by day (d.m.Y), 0 once rolled up
+        self.pendingrecords = {}
+
+    def _pendingfiles(self, day):
+        # the time in the name keeps them in order
+        pendingdir = os.path.join(self._outfile(day, self.suffix), '_pending')
+        return sorted(glob.glob(os.path.join(pendingdir, 'part-*.parquet')))
+
+    def _countpending(self, day):
+        import pyarrow.parquet as pq
+
+        if day not in self.pendingrecords:
+            self.pendingrecords[day] = sum(pq.read_metadata(i).num_rows
+                                           for i in self._pendingfiles(day))
+        return self.pendingrecords[day]
+
+    def _writetable(self, table, outfile):
+        import pyarrow.parquet as pq
+
+        # written next to it and moved, readers never see a partial file
+        pq.write_table(table, outfile + '.tmp')
+        os.replace(outfile + '.tmp', outfile)
+
+    def write(self, data):
+        import pyarrow as pa
+
+        for day, index_of_day in self._days(data).items():
+            columns = {'time': np.asarray([data['-1'][i] for i in index_of_day])}
+            columns.update(self._columns(data, index_of_day))
+
+            # leftovers of the day before from an earlier run are rolled up with it
+            previous = datetime.datetime.strptime(day, '%d.%m.%Y') - datetime.timedelta(days=1)
+            self._countpending(previous.strftime('%d.%m.%Y'))
+            npending = self._countpending(day)
+
+            # a retried batch overwrites its own pending file
+            pendingdir = os.path.join(self._outfile(day, self.suffix), '_pending')
+            os.makedirs(pendingdir, exist_ok=True)
+            self._writetable(pa.table(columns),
+                             os.path.join(pendingdir, f'part-{columns["time"][0]:.0f}.parquet'))
+            self.pendingrecords[day] = npending + len(index_of_day)
+
+            if not self.parsivel.quiet:
+                print(f'Written {len(index_of_day)} records to {pendingdir}')
+
+            if self.pendingrecords[day] >= self.partrecords:
+                self.flush(day)
+
+        # days before the latest one are complete
+        for day in sorted(self.pendingrecords, key=lambda i: i.split('.')[::-1])[:-1]:
+            if self.pendingrecords[day]:
+                self.flush(day)
+
+    def flush(self, day):
+        """
+        Roll up the pending files of day (d.m.Y) into part files.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pendingfiles = self._pendingfiles(day)
+        # consecutive batches of the same schema go into one part
+        groups = []
+        for table in [pq.read_table(i) for i in pendingfiles]:
+            if groups and groups[-1][0].schema.equals(table.schema):
+                groups[-1].append(table)
+            else:
+                groups.append([table])
+
+        outdir = self._outfile(day, self.suffix)
+        for tables in groups:
+            table = pa.concat_tables(tables)
+            outfile = os.path.join(outdir, f'part-{table["time"][0].as_py():.0f}.parquet')
+            self._writetable(table, outfile)
+
+            if not self.parsivel.quiet:
+                print(f'Written {len(table)} records to {outfile}')
+
+        for pendingfile in pendingfiles:
+            os.remove(pendingfile)
+        self.pendingrecords[day] = 0
+
+    def close(self):
+        for day, npending in self.pendingrecords.items():
+            if npending:
+                self.flush(day)
+
+
+class parsivel_zarrwriter(parsivel_writer):
+    """
+    Scalars and spectra as daily zarr store (parsivel_Ymd.zarr), requires zarr.
+
+    Every variable is an array with time as first dimension that batches are
+    appended to, spectra are chunked by chunkrecords records.
+    """
+    name = 'zarr'
+    suffix = '.zarr'
+
+    def __init__(self, parsivel, intosubdirs=True, chunkrecords=360):
+        super().__init__(parsivel, intosubdirs=intosubdirs)
+        self.chunkrecords = chunkrecords
+
+    def write(self, data):
+        import zarr
+
+        for day, index_of_day in self._days(data).items():
+            columns = {'time': np.asarray([data['-1'][i] for i in index_of_day])}
+            columns.update(self._columns(data, index_of_day))
+            columns.update(self._columns(data, index_of_day, spectra=True))
+
+            outfile = self._outfile(day, self.suffix)
+            group = zarr.open_group(outfile, mode='a')
+            for name, values in columns.items():
+                if name not in group:
+                    # zarr 3 renamed create_dataset to create_array
+                    create = getattr(group, 'create_array', None) or group.create_dataset
+                    create(name, shape=(0,) + values.shape[1:], dtype=values.dtype,
+                           chunks=(self.chunkrecords,) + values.shape[1:])
+                group[name].append(values, axis=0)
+
+            if not self.parsivel.quiet:
+                print(f'Written {len(index_of_day)} records to {outfile}')
+
+
+class parsivel_liveserver:
+    """
+    Fan out live frames (see encodeframe) to local subscribers.
+
+    Every subscriber gets its own queue of maxqueue frames and sender
+    thread, so a slow subscriber never blocks acquisition or the others.
+    If its queue is full, droppolicy decides whether the oldest queued or
+    the newest frame is dropped. Subscribers just connect and read frames,
+    e.g. with readframe.
+    """
+
+    def __init__(self, address, maxqueue=100, droppolicy='oldest', quiet=True):
+        assert droppolicy in ['oldest', 'newest'], 'droppolicy has to be oldest or newest'
+
+        self.address = address
+        self.maxqueue = maxqueue
+        self.droppolicy = droppolicy
+        self.quiet = quiet
+        self.sock = None
+        # connection -> queue of frames
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        if ':' in self.address:
+            host, port = self.address.rsplit(':', 1)
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((host, int(port)))
+        else:
+            # a stale socket from an earlier run blocks binding
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(self.address)
+
+        self.sock.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while self.sock is not None:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+
+            frames = queue.Queue(self.maxqueue)
+            with self.lock:
+                self.subscribers[conn] = frames
+            threading.Thread(target=self._send, args=(conn, frames), daemon=True).start()
             if not self.quiet:
-                print(f'Written {ntimesteps} records to {_outpath+self.outfile} for {day}')
+                print(f'Live subscriber connected, now {len(self.subscribers)}')
+
+    def _send(self, conn, frames):
+        while True:
+            frame = frames.get()
+            try:
+                if frame is None:
+                    raise OSError('closed')
+                conn.sendall(frame)
+            except OSError:
+                with self.lock:
+                    self.subscribers.pop(conn, None)
+                conn.close()
+                return
+
+    def publish(self, frame):
+        self.published += 1
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+
+        for frames in subscribers:
+            try:
+                frames.put_nowait(frame)
+            except queue.Full:
+                self.dropped += 1
+                if self.droppolicy == 'newest':
+                    continue
+                try:
+                    frames.get_nowait()
+                    frames.put_nowait(frame)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def close(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for frames in subscribers:
+            # wakes up the sender which then closes the connection
+            try:
+                frames.put_nowait(None)
+            except queue.Full:
+                frames.get_nowait()
+                frames.put_nowait(None)
+
+        if ':' not in self.address and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class parsivel_catalog:
+    """
+    SQLite index of the output files, updated as write2file writes batches.
+
+    The table files holds per file its format, first/last unix time, number
+    of records and summary stats (precipitation in mm from 01 and 09, max
+    rain rate in mm/h, particles from 11), the table hours the same stats
+    per file and hour. Time-range and event queries never touch the data
+    files, rebuild indexes an existing archive.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, format TEXT, first REAL, last REAL, records INTEGER,
+            precipitation REAL, maxrainrate REAL, particles INTEGER);
+        CREATE INDEX IF NOT EXISTS files_time ON files (first, last);
+        CREATE TABLE IF NOT EXISTS hours (
+            path TEXT, hour INTEGER, records INTEGER,
+            precipitation REAL, maxrainrate REAL, particles INTEGER,
+            PRIMARY KEY (path, hour));
+        CREATE INDEX IF NOT EXISTS hours_hour ON hours (hour);
+        """
 
-if __name__ == '__main__':
-    parsivel = parsivel_moxa(outpath='/media/data/parsivel/',)
-    #parsivel.help()
-    #parsivel.pollcode(33)
-    #parsivel.pollcode(93)
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(self.schema)
+
+    def close(self):
+        self.connection.close()
+
+    def _values(self, data, code, index, default=0.):
+        # numbers of code for the records index, unparseable ones as nan
+        if not data.get(code):
+            return np.full(len(index), default)
+        values = [data[code][i] for i in index]
+        return np.asarray([i if isinstance(i, (int, float, np.number)) else np.nan
+                           for i in values], dtype=float)
+
+    def add(self, path, fileformat, data, index=None):
+        """
+        Add the records index (default all) of a batch like parsivel_moxa.data to path.
+        """
+        # as rebuild stores them, whether outpath is relative or not
+        path = os.path.abspath(path)
+        if index is None:
+            index = range(len(data['-1']))
+        if not len(index):
+            return
+
+        unixtime = self._values(data, '-1', index)
+        rainrate = self._values(data, '01', index)
+        particles = self._values(data, '11', index)
+        if data.get('09'):
+            interval = self._values(data, '09', index)
+        else:
+            # e.g. rebuilt from ASDO files, which have no sample interval
+            interval = np.full(len(index), np.median(np.diff(unixtime)) if len(index) > 1 else 0.)
+        precipitation = np.nan_to_num(rainrate * interval / 3600)
+        rainrate = np.nan_to_num(rainrate)
+        particles = np.nan_to_num(particles)
+
+        hours, inverse = np.unique(unixtime // 3600 * 3600, return_inverse=True)
+        maxrainrate = np.zeros(len(hours))
+        np.maximum.at(maxrainrate, inverse, rainrate)
+        hourly = zip(hours.astype(int).tolist(),
+                     np.bincount(inverse).tolist(),
+                     np.bincount(inverse, precipitation).tolist(),
+                     maxrainrate.tolist(),
+                     np.bincount(inverse, particles).astype(int).tolist())
+
+        with self.connection:
+            self.connection.execute(
+                """INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (path) DO UPDATE SET
+                   first = min(first, excluded.first), last = max(last, excluded.last),
+                   records = records + excluded.records,
+                   precipitation = precipitation + excluded.precipitation,
+                   maxrainrate = max(maxrainrate, excluded.maxrainrate),
+                   particles = particles + excluded.particles""",
+                (path, fileformat, unixtime.min(), unixtime.max(), len(index),
+                 precipitation.sum(), rainrate.max(), int(particles.sum())))
+            self.connection.executemany(
+                """INSERT INTO hours VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (path, hour) DO UPDATE SET
+                   records = records + excluded.records,
+                   precipitation = precipitation + excluded.precipitation,
+                   maxrainrate = max(maxrainrate, excluded.maxrainrate),
+                   particles = particles + excluded.particles""",
+                [(path,) + row for row in hourly])
+
+    def addbatch(self, writer, data):
+        # a batch that writer has just written
+        for path, index_of_day in writer.outfiles(data).items():
+            self.add(path, writer.name, data, index_of_day)
+
+    def files(self, start=None, end=None, fileformat=None):
+        """
+        Files with records between start and end (unix time), oldest first.
+
+        Returns
+        -------
+        files : list of tuple
+            (path, format, first, last, records, precipitation, maxrainrate, particles)
+
+        """
+        query = 'SELECT * FROM files WHERE last >= ? AND first <= ?'
+        parameters = [-np.inf if start is None else start, np.inf if end is None else end]
+        if fileformat is not None:
+            query += ' AND format = ?'
+            parameters += [fileformat]
+        return self.connection.execute(query + ' ORDER BY first, path', parameters).fetchall()
+
+    def hours(self, start=None, end=None, minrainrate=None, minprecipitation=None,
+              fileformat=None):
+        """
+        Hours (unix time of their start) between start and end, e.g. all
+        hours with more than 5 mm/h by minrainrate=5.
+
+        The same records are usually written in several formats, so the
+        stats of an hour are those of the format that holds most of it.
+
+        Returns
+        -------
+        hours : list of tuple
+            (hour, records, precipitation, maxrainrate, particles)
+
+        """
+        query = """SELECT hour, max(records), max(precipitation), max(maxrainrate), max(particles)
+                   FROM (SELECT format, hour, sum(hours.records) AS records,
+                         sum(hours.precipitation) AS precipitation,
+                         max(hours.maxrainrate) AS maxrainrate, sum(hours.particles) AS particles
+                         FROM hours JOIN files USING (path)
+                         WHERE hour >= ? AND hour <= ? {}
+                         GROUP BY format, hour)
+                   GROUP BY hour HAVING max(maxrainrate) >= ? AND max(precipitation) >= ?
+                   ORDER BY hour"""
+        parameters = [-np.inf if start is None else start // 3600 * 3600,
+                      np.inf if end is None else end]
+        if fileformat is not None:
+            query = query.format('AND format = ?')
+            parameters += [fileformat]
+        else:
+            query = query.format('')
+        parameters += [minrainrate or -np.inf, minprecipitation or -np.inf]
+        return self.connection.execute(query, parameters).fetchall()
+
+    def rebuild(self, outpath, fileprefix='parsivel_'):
+        """
+        Index the nc and (compressed) ASDO csv files below outpath from scratch.
+
+        Returns
+        -------
+        nfiles : int
+            The number of indexed files.
+
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM files')
+            self.connection.execute('DELETE FROM hours')
+
+        nfiles = 0
+        pattern = os.path.join(outpath, '**', fileprefix + '*')
+        for path in sorted(glob.glob(pattern + '.nc', recursive=True)):
+            try:
+                data = self._readncfile(path)
+            except Exception as e:
+                print(f'Could not index {path}: {e}')
+                continue
+            self.add(os.path.abspath(path), 'nc', data)
+            nfiles += 1
+
+        for path in sorted(glob.glob(pattern + '.csv', recursive=True)
+                           + glob.glob(pattern + '.csv.gz', recursive=True)
+                           + glob.glob(pattern + '.csv.zst', recursive=True)):
+            try:
+                data = self._readasdofile(path)
+            except Exception as e:
+                print(f'Could not index {path}: {e}')
+                continue
+            fileformat = {'.gz': 'asdogz', '.zst': 'asdozst'}.get(os.path.splitext(path)[1], 'asdo')
+            self.add(os.path.abspath(path), fileformat, data)
+            nfiles += 1
+        return nfiles
+
+    def _readncfile(self, path):
+        # the catalog codes of a daily nc file
+        nc = _netcdf4()
+        with nc.Dataset(path, 'r') as nchandle:
+            nchandle.set_auto_mask(False)
+            data = {'-1': nchandle.variables['time'][:].astype(float).tolist()}
+            for code in ['01', '09', '11']:
+                field = telegramfields[code]
+                if field.ncname not in nchandle.variables:
+                    continue
+                values = nchandle.variables[field.ncname][:].astype(float)
+                values[values == field.fill_value] = np.nan
+                if field.transform is not None:
+                    # the transforms of these codes are linear scalings
+                    values = values / field.transform(1.)
+                data[code] = values.tolist()
+        return data
+
+    def _readasdofile(self, path):
+        # the catalog codes of a daily ASDO csv file, without parsing the spectra
+        data = readasdofile(path, columns=['01', '11'])
+        return dict({'-1': data['time'].tolist()},
+                    **{code: data[code].tolist() for code in ['01', '11'] if code in data})
+
+
+# backends selectable via outputformats / [output] formats in the config
+writerbackends = {writer.name: writer for writer in [parsivel_ncwriter,
+                                                     parsivel_asdowriter,
+                                                     parsivel_asdogzwriter,
+                                                     parsivel_asdozstwriter,
+                                                     parsivel_parquetwriter,
+                                                     parsivel_zarrwriter]}
+
+
+def _compactdtype(values, dtype, counts=False):
+    # smallest dtype of the same kind, floats only become integers for counts
+    valid = np.ma.compressed(values)
+    if dtype.kind == 'f' and not (counts and valid.size and np.all(np.mod(valid, 1) == 0)):
+        return np.dtype('f4')
+
+    if dtype.kind not in 'fiu' or valid.size == 0:
+        return dtype
+
+    # -999 is used as fill value, so unsigned types are no option
+    for compact in [np.dtype('i2'), np.dtype('i4')]:
+        info = np.iinfo(compact)
+        if valid.min() >= info.min and valid.max() <= info.max:
+            return compact
+    return dtype
+
+
+def compactncfile(ncfile, outfile=None, complevel=4, chunkrecords=1440,
+                  countvariables=('data_raw', 'data_filtered')):
+    """
+    Rewrite a completed daily nc file into a read optimized NETCDF4 file.
+
+    All dimensions become fixed. Variables along time (or another unlimited
+    dimension) get compact dtypes: float32 for floats, the smallest integer
+    type for integers and for the float counts of countvariables. 1d
+    variables are stored contiguous, spectra chunked by chunkrecords
+    records with zlib compression. The result is written next to the target and moved
+    over it, so readers never see a partial file. If ncfile changed meanwhile
+    (size or mtime, e.g. a late batch was appended), it is left as is.
+
+    Returns
+    -------
+    outfile : str or None
+        The written file, None if ncfile had already been compacted or changed
+        while it was rewritten.
+
+    """
+    nc = _netcdf4()
+    if outfile is None:
+        outfile = ncfile
+
+    before = os.stat(ncfile)
+    with nc.Dataset(ncfile, 'r') as src:
+        if hasattr(src, 'Compacted'):
+            return None
+
+        tmpfile = outfile + '.compact.tmp'
+        with nc.Dataset(tmpfile, 'w', format='NETCDF4') as dst:
+            for name, dimension in src.dimensions.items():
+                dst.createDimension(name, len(dimension))
+
+            dst.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+            setattr(dst, 'Compacted', str(datetime.datetime.utcnow()) + ' (UTC)')
+
+            for name, srcvar in src.variables.items():
+                srcvar.set_auto_mask(True)
+                values = srcvar[:]
+                dtype = srcvar.dtype
+                if srcvar.ndim and src.dimensions[srcvar.dimensions[0]].isunlimited():
+                    dtype = _compactdtype(values, dtype, counts=name in countvariables)
+
+                fill_value = getattr(srcvar, '_FillValue', None)
+                if fill_value is not None:
+                    fill_value = np.asarray(fill_value).astype(dtype)
+
+                kwargs = {'contiguous': True}
+                if srcvar.ndim > 1 and np.prod(srcvar.shape[1:]) > 2 and len(values):
+                    kwargs = {'zlib': True, 'complevel': complevel, 'shuffle': True,
+                              'chunksizes': (min(chunkrecords, len(values)),) + srcvar.shape[1:]}
+
+                dstvar = dst.createVariable(name, dtype, srcvar.dimensions,
+                                            fill_value=fill_value, **kwargs)
+                dstvar.setncatts({key: srcvar.getncattr(key) for key in srcvar.ncattrs()
+                                  if key != '_FillValue'})
+                if srcvar.ndim == 0:
+                    dstvar.assignValue(values)
+                elif values.size:
+                    dstvar[:] = values
+
+    after = os.stat(ncfile)
+    if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+        print(f'{ncfile} changed while compacting, leaving it for a later run')
+        os.remove(tmpfile)
+        return None
+
+    os.replace(tmpfile, outfile)
+    return outfile
+
+
+def compactarchive(outpath, fileprefix='parsivel_', processes=None, before=None, grace=3600,
+                   **kwargs):
+    """
+    Compact all daily nc files below outpath of days before `before` in parallel.
+
+    before defaults to today (UTC) so the file currently appended to is
+    left alone, as are the _late.nc files of compacted days, which later
+    records keep going to. Files modified within the last grace seconds
+    are skipped as well, as queued or retried batches of a past day may
+    still be appended to them. Keyword arguments are passed on to
+    compactncfile.
+
+    Returns
+    -------
+    compacted : list of str
+        The files that have been rewritten.
+
+    """
+    if before is None:
+        before = datetime.datetime.utcnow().strftime('%Y%m%d')
+
+    ncfiles = []
+    for ncfile in sorted(glob.glob(os.path.join(outpath, '**', fileprefix + '*.nc'), recursive=True)):
+        day = os.path.basename(ncfile)[len(fileprefix):len(fileprefix) + 8]
+        # only the day files, late records (_late.nc) of a compacted day stay appendable
+        if os.path.basename(ncfile) != fileprefix + day + '.nc':
+            continue
+        if day.isdigit() and day < before and time.time() - os.path.getmtime(ncfile) >= grace:
+            ncfiles += [ncfile]
+
+    compacted = []
+    with multiprocessing.Pool(processes) as pool:
+        for ncfile, outfile in zip(ncfiles, pool.starmap(_compactworker,
+                                                         [(i, kwargs) for i in ncfiles])):
+            if isinstance(outfile, Exception):
+                print(f'Compacting {ncfile} failed: {outfile}')
+            elif outfile is not None:
+                print(f'Compacted {outfile}')
+                compacted += [outfile]
+    return compacted
+
+
+def _compactworker(ncfile, kwargs):
+    # a broken file should not stop the whole pool
     try:
+        return compactncfile(ncfile, **kwargs)
+    except Exception as e:
+        return e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Sample an OTT Parsivel-2 and write the data to netCDF/ASDO files.')
+    parser.add_argument('-c', '--config', default=None,
+                        help='TOML or YAML station config, reread on SIGHUP')
+    parser.add_argument('--port', default=None,
+                        help='serial port, overrides the config')
+    parser.add_argument('--outpath', default=None,
+                        help='output directory, overrides the config')
+    parser.add_argument('--duration', type=int, default=-1,
+                        help='seconds to sample, negative values run until stopped (default)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', help='sample the parsivel (default)')
+    compactparser = subparsers.add_parser(
+        'compact', help='rewrite completed daily nc files for fast reading')
+    compactparser.add_argument('paths', nargs='*',
+                               help='archive directories, default the outpath')
+    compactparser.add_argument('--processes', type=int, default=None,
+                               help='parallel processes, default one per cpu')
+    compactparser.add_argument('--before', default=None,
+                               help='only days before this Ymd, default today (UTC)')
+    compactparser.add_argument('--grace', type=float, default=3600,
+                               help='skip files modified within this many seconds, default 3600')
+    catalogparser = subparsers.add_parser(
+        'catalog', help='list the files or hours of a period from the catalog')
+    catalogparser.add_argument('--catalog', default=None,
+                               help='sqlite file, default parsivel_catalog.sqlite in the outpath')
+    catalogparser.add_argument('--rebuild', action='store_true',
+                               help='index the nc and csv files of the outpath first')
+    catalogparser.add_argument('--start', default=None, help='ISO date/time (UTC)')
+    catalogparser.add_argument('--end', default=None, help='ISO date/time (UTC)')
+    catalogparser.add_argument('--format', default=None, help='only files of this format')
+    catalogparser.add_argument('--hours', action='store_true',
+                               help='list hours instead of files')
+    catalogparser.add_argument('--minrainrate', type=float, default=None,
+                               help='only hours with a higher max rain rate (mm/h)')
+    catalogparser.add_argument('--minprecipitation', type=float, default=None,
+                               help='only hours with more precipitation (mm)')
+    args = parser.parse_args(argv)
+
+    if args.command in ['compact', 'catalog']:
+        outpath = args.outpath
+        fileprefix = 'parsivel_'
+        catalogpath = None
+        if args.config is not None:
+            config = loadconfig(args.config)
+            outpath = outpath or config['station'].get('outpath')
+            fileprefix = config['station'].get('fileprefix', fileprefix)
+            catalogpath = config['output'].get('catalog')
+        outpath = outpath or '/media/data/parsivel/'
+
+    if args.command == 'compact':
+        for path in args.paths or [outpath]:
+            compactarchive(path, fileprefix=fileprefix, processes=args.processes,
+                           before=args.before, grace=args.grace)
+        return 0
+
+    if args.command == 'catalog':
+        if args.catalog is None and isinstance(catalogpath, str):
+            args.catalog = catalogpath
+        catalog = parsivel_catalog(args.catalog or os.path.join(outpath, 'parsivel_catalog.sqlite'))
+        if args.rebuild:
+            print(f'Indexed {catalog.rebuild(outpath, fileprefix)} files of {outpath}')
+
+        start, end = [None if i is None else
+                      datetime.datetime.fromisoformat(i).replace(tzinfo=datetime.timezone.utc).timestamp()
+                      for i in [args.start, args.end]]
+
+        def isotime(unixtime):
+            return datetime.datetime.fromtimestamp(unixtime, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+        if args.hours or args.minrainrate is not None or args.minprecipitation is not None:
+            print('hour,records,precipitation (mm),max rain rate (mm/h),particles')
+            for hour, records, precipitation, maxrainrate, particles in catalog.hours(
+                    start, end, args.minrainrate, args.minprecipitation, args.format):
+                print(f'{isotime(hour)},{records},{precipitation:.2f},{maxrainrate:.3f},{particles}')
+        else:
+            print('path,format,first,last,records,precipitation (mm),max rain rate (mm/h),particles')
+            for path, fileformat, first, last, records, precipitation, maxrainrate, particles \
+                    in catalog.files(start, end, args.format):
+                print(f'{path},{fileformat},{isotime(first)},{isotime(last)},{records},'
+                      f'{precipitation:.2f},{maxrainrate:.3f},{particles}')
+        catalog.close()
+        return 0
+
+    if args.config is not None and loadconfig(args.config)['sensors']:
+        # several addressed parsivels on one port
+        parsivel = parsivel_bus.fromconfig(args.config, port=args.port,
+                                           outpath=args.outpath)
+    elif args.config is not None:
+        parsivel = parsivel_moxa.fromconfig(args.config, port=args.port,
+                                            outpath=args.outpath)
+    else:
+        parsivel = parsivel_moxa(port=args.port or '/dev/ttyUSB0',
+                                 outpath=args.outpath or '/media/data/parsivel/')
+
+    if args.duration < 0:
+        parsivel.run()
+    else:
+        parsivel.maxsampling = args.duration
         parsivel.sample()
-    except KeyboardInterrupt:
-        print('Sampling interrupted.')
-
-    #time.sleep(1)
-    #cfg = parsivel.getconfig()
-    #print(cfg)
-    #time.sleep(1)
-    #curdt = 0
-    #try:
-    #    while curdt <= maxdt :
-    #        parsivel.getparsiveldata()
-    #        #if curdt % 60 == 0:
-    #        parsivel.write2file()
-    #        time.sleep(dt)
-    #        curdt += dt
-    #except serial.SerialException:
-    #    print('Issue with serial connection encounted, rerun...')
-    #    del parsivel
-    #finally:
-    #    del parsivel
-
-   
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,370 @@
+#!/bin/python3
+"""
+Soak and scaling harness for parsivel2file.
+
+Drives N simulated parsivels, each in its own process like the daemon
+would run, through accelerated multi-day runs of the real sample() and
+writer code paths. Time only advances virtually (sleeps return at once),
+so days of 10 s records run in minutes. Per simulated hour, every
+instrument records CPU time per record, time spent writing, buffered
+records, RSS and the day rollovers. The run fails (exit code 1) if the
+per-record cost or the RSS trend upwards beyond the tolerances.
+"""
+import os
+import sys
+import time
+import types
+import argparse
+import datetime
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import parsivel2file
+
+
+class virtualclock:
+    # unix time that only advances by sleeping
+    def __init__(self, start):
+        self.now = start
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+
+def _installclock(clock):
+    # parsivel2file only sees the virtual time, everything else the real one
+    class _virtualdatetime(datetime.datetime):
+        @classmethod
+        def utcnow(cls):
+            return cls.fromtimestamp(clock.now, datetime.timezone.utc).replace(tzinfo=None)
+
+    class _virtualtime:
+        def __getattr__(self, name):
+            return getattr(time, name)
+
+        def sleep(self, seconds):
+            clock.sleep(seconds)
+
+        def time(self):
+            return clock.now
+
+    parsivel2file.time = _virtualtime()
+    parsivel2file.datetime = types.SimpleNamespace(datetime=_virtualdatetime,
+                                                   timezone=datetime.timezone,
+                                                   timedelta=datetime.timedelta)
+
+
+class framecheck:
+    # stands in for parsivel_liveserver and checks the round trip of every frame
+    def __init__(self):
+        self.frames = 0
+        self.mismatches = 0
+
+    def publish(self, frame):
+        unixtime, scalars, spectrum = parsivel2file.decodeframe(frame)
+        self.frames += 1
+        # the simulated spectrum always sums up to 11
+        if spectrum.count.sum() != scalars.get('11'):
+            self.mismatches += 1
+
+    def close(self):
+        pass
+
+
+class simulatedparsivel(parsivel2file.parsivel_moxa):
+    """
+    A parsivel_moxa whose serial port is replaced by a simulated sensor.
+
+    Rain events come and go as a two state markov chain, during rain the
+    spectrum holds on average `meanparticles` particles.
+    """
+
+    def __init__(self, seed=0, rainprobability=0.001, dryprobability=0.01,
+                 meanparticles=200, **kwargs):
+        self.rng = np.random.default_rng(seed)
+        self.rainprobability = rainprobability
+        self.dryprobability = dryprobability
+        self.meanparticles = meanparticles
+        self.raining = False
+        # measuring interval of the simulated sensor, set by CS/I
+        self.sensorinterval = None
+        self.response = b''
+        self.simopen = False
+        self.rows = []
+        super().__init__(port=None, **kwargs)
+
+    # the serial port
+    def open(self):
+        self.simopen = True
+
+    def close(self):
+        self.simopen = False
+
+    def isOpen(self):
+        return self.simopen
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.response = b''
+
+    @property
+    def in_waiting(self):
+        return len(self.response)
+
+    def read(self, size=1):
+        data, self.response = self.response[:size], self.response[size:]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        index = self.response.find(expected)
+        return self.read(len(self.response) if index < 0 else index + len(expected))
+
+    def write(self, data):
+        self.response += self._answer(data)
+        return len(data)
+
+    # the sensor
+    def _answer(self, cmd):
+        now = parsivel2file.datetime.datetime.utcnow()
+        if cmd.startswith(b'CS/PA'):
+            return self._telegram(now)
+        if cmd.startswith(b'CS/U\r'):
+            return now.strftime('%d.%m.%Y %H:%M:%S\r\n').encode()
+        if cmd.startswith(b'CS/K\r'):
+            return self.stationname.encode() + b'\r\n'
+        if cmd.startswith(b'CS/I/'):
+            self.sensorinterval = int(cmd[5:].strip())
+        return b'OK\r\n'
+
+    def _telegram(self, now):
+        if self.raining:
+            self.raining = self.rng.random() > self.dryprobability
+        else:
+            self.raining = self.rng.random() < self.rainprobability
+
+        spectrum = np.zeros(1024, dtype=int)
+        if self.raining:
+            bins = self.rng.integers(0, 1024, self.rng.poisson(self.meanparticles))
+            np.add.at(spectrum, bins, 1)
+
+        nparticles = spectrum.sum()
+        values = {'01': f'{nparticles * 0.01:08.3f}', '02': '0000.00',
+                  '03': '61' if nparticles else '00', '04': '61' if nparticles else '00',
+                  '05': 'RA' if nparticles else 'NP', '06': 'R' if nparticles else 'C',
+                  '07': '-9.999', '08': '20000', '09': f'{self.sensorinterval or self.samplinginterval:05d}',
+                  '10': '21000', '11': f'{nparticles:05d}', '12': '021', '13': '411994',
+                  '16': '0.00', '17': '23.8', '18': '0',
+                  '20': now.strftime('%H:%M:%S'), '21': now.strftime('%d.%m.%Y'),
+                  '22': self.stationname, '23': '0000', '24': '0000.000', '25': '000',
+                  '34': '000.000', '35': '0000.000',
+                  '90': ';'.join(['-9.999'] * 32) + ';',
+                  '91': ';'.join(['00.000'] * 32) + ';',
+                  '93': ';'.join(f'{i:03d}' for i in spectrum) + ';',
+                  }
+        lines = ['PA'] + [f'{key}:{value}' for key, value in values.items()]
+        return ('\r\n'.join(lines) + '\r\n').encode(self.codec) + b'\x03'
+
+    # the measurements
+    def write2file(self):
+        records = len(self.data['-1'])
+        days = set(self.data.get('21', []))
+        newday = bool(days - self.seendays)
+        self.seendays |= days
+
+        start = time.perf_counter()
+        super().write2file()
+        writetime = time.perf_counter() - start
+
+        bucket = self.bucket
+        bucket['records'] += records
+        bucket['writetime'] += writetime
+        bucket['maxbuffered'] = max(bucket['maxbuffered'], records)
+        if newday and len(self.seendays) > 1:
+            bucket['rollovers'] += 1
+            bucket['rollovertime'] += writetime
+
+        hour = int(parsivel2file.time.time() // 3600)
+        if hour != bucket['hour']:
+            self._closebucket(hour)
+
+    def _closebucket(self, hour):
+        cputime = time.process_time()
+        bucket = self.bucket
+        if bucket['hour'] is not None and bucket['records']:
+            self.rows.append({'instrument': self.stationname,
+                              'hour': bucket['hour'],
+                              'records': bucket['records'],
+                              'cpu_per_record': (cputime - bucket['cputime']) / bucket['records'],
+                              'write_per_record': bucket['writetime'] / bucket['records'],
+                              'maxbuffered': bucket['maxbuffered'],
+                              'rollovers': bucket['rollovers'],
+                              'rollovertime': bucket['rollovertime'],
+                              'rss': _rss(),
+                              })
+        self.bucket = {'hour': hour, 'records': 0, 'writetime': 0, 'maxbuffered': 0,
+                       'rollovers': 0, 'rollovertime': 0, 'cputime': cputime}
+
+    def soak(self, duration, writeoutfreq):
+        self.seendays = set()
+        self.bucket = {'hour': None}
+        self._closebucket(None)
+        self.maxsampling = duration
+        self.sample(writeoutfreq=writeoutfreq)
+        return self.rows
+
+
+def _rss():
+    # current resident set size in bytes
+    try:
+        with open('/proc/self/statm') as fo:
+            return int(fo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _soakinstrument(kwargs):
+    # one instrument per process, as the daemon would run
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+    _installclock(virtualclock(kwargs.pop('start')))
+
+    duration = kwargs.pop('duration')
+    writeoutfreq = kwargs.pop('writeoutfreq')
+    formats = kwargs.pop('formats')
+    interval = kwargs.pop('samplinginterval')
+    adaptive = kwargs.pop('adaptive')
+
+    parsivel = simulatedparsivel(**kwargs)
+    parsivel.samplinginterval = interval
+    if adaptive:
+        parsivel.adaptive = True
+        parsivel.eventinterval = interval
+    parsivel.setwriters(formats)
+    # every record is published, with the spectrum dense unless sparse
+    live = parsivel.liveserver = framecheck()
+    rows = parsivel.soak(duration, writeoutfreq)
+    return rows, (live.frames, live.mismatches)
+
+
+def _relativetrend(hours, values):
+    # fitted change over the whole run relative to the median
+    if len(values) < 3 or np.median(values) == 0:
+        return 0.
+    slope = np.polyfit(hours, values, 1)[0]
+    return slope * (hours[-1] - hours[0]) / np.median(values)
+
+
+def soak(instruments=2, days=2, samplinginterval=10, writeoutfreq=60,
+         formats=('asdo', 'nc'), adaptive=False, outpath=None, processes=None,
+         costtolerance=0.5, rsstolerance=0.25, warmup=0.1, curves=None):
+    """
+    Run the soak test and check the resource curves.
+
+    costtolerance and rsstolerance are the allowed growth of CPU time per
+    record and RSS over the run (fitted trend relative to the median), the
+    first `warmup` fraction of every run is ignored. With adaptive, the
+    instruments sample adaptively with samplinginterval as eventinterval.
+    Every record also goes through publish and has to decode to the same
+    spectrum sum as its particle count.
+
+    Returns
+    -------
+    passed : bool
+        Whether no trend exceeded its tolerance and all live frames matched.
+    rows : list of dict
+        The hourly measurements of all instruments.
+
+    """
+    if outpath is None:
+        outpath = tempfile.mkdtemp(prefix='parsivel_soak_')
+
+    start = datetime.datetime(2023, 1, 1, 0, 0, 30, tzinfo=datetime.timezone.utc).timestamp()
+    jobs = [{'start': start, 'duration': int(days * 86400), 'writeoutfreq': writeoutfreq,
+             'formats': list(formats), 'samplinginterval': samplinginterval, 'seed': i,
+             'adaptive': adaptive,
+             'outpath': os.path.join(outpath, f'instrument{i:02d}'),
+             'stationname': f'Soak{i:02d}'}
+            for i in range(instruments)]
+
+    realstart = time.perf_counter()
+    with multiprocessing.Pool(processes or instruments) as pool:
+        results = pool.map(_soakinstrument, jobs)
+    realtime = time.perf_counter() - realstart
+    results, live = zip(*results)
+
+    rows = [row for result in results for row in result]
+    if curves is not None:
+        with open(curves, 'w') as fo:
+            fo.write(','.join(rows[0].keys()) + '\n')
+            for row in rows:
+                fo.write(','.join(str(i) for i in row.values()) + '\n')
+
+    passed = True
+    nrecords = sum(row['records'] for row in rows)
+    print(f'{instruments} instruments, {days} days, {nrecords} records in {realtime:.1f} s '
+          f'({nrecords / realtime:.0f} records/s), output in {outpath}')
+
+    for result, (frames, mismatches) in zip(results, live):
+        result = result[int(len(result) * warmup):]
+        if not result:
+            continue
+
+        hours = np.asarray([row['hour'] for row in result], dtype=float)
+        cost = np.asarray([row['cpu_per_record'] for row in result])
+        write = np.asarray([row['write_per_record'] for row in result])
+        rss = np.asarray([row['rss'] for row in result], dtype=float)
+        rollovers = [row['rollovertime'] for row in result if row['rollovers']]
+
+        costtrend = _relativetrend(hours, cost)
+        rsstrend = _relativetrend(hours, rss)
+        ok = costtrend <= costtolerance and rsstrend <= rsstolerance and not mismatches
+        passed &= ok
+
+        print(f'{result[0]["instrument"]}: {"ok" if ok else "FAILED"}, '
+              f'cpu/record {np.median(cost) * 1000:.2f} ms (trend {costtrend:+.0%}), '
+              f'write/record {np.median(write) * 1000:.2f} ms (trend {_relativetrend(hours, write):+.0%}), '
+              f'rss {np.median(rss) / 2**20:.1f} MB (trend {rsstrend:+.0%}), '
+              f'max buffered {max(row["maxbuffered"] for row in result)} records, '
+              f'rollover {np.mean(rollovers) * 1000 if rollovers else np.nan:.1f} ms, '
+              f'{mismatches} of {frames} live frames wrong')
+
+    return passed, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Soak test the acquisition stack with simulated parsivels over accelerated days.')
+    parser.add_argument('--instruments', type=int, default=2)
+    parser.add_argument('--days', type=float, default=2)
+    parser.add_argument('--interval', type=int, default=10,
+                        help='sampling interval in (simulated) seconds')
+    parser.add_argument('--writeoutfreq', type=int, default=60)
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adaptive sampling with --interval during rain events')
+    parser.add_argument('--formats', nargs='+', default=['asdo', 'nc'],
+                        help=f'output formats, of {list(parsivel2file.writerbackends)}')
+    parser.add_argument('--outpath', default=None, help='default a temporary directory')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--costtolerance', type=float, default=0.5,
+                        help='allowed relative growth of cpu time per record')
+    parser.add_argument('--rsstolerance', type=float, default=0.25,
+                        help='allowed relative growth of the rss')
+    parser.add_argument('--curves', default=None, help='write the hourly curves to this csv')
+    args = parser.parse_args(argv)
+
+    passed, _ = soak(instruments=args.instruments, days=args.days,
+                     samplinginterval=args.interval, writeoutfreq=args.writeoutfreq,
+                     formats=args.formats, adaptive=args.adaptive,
+                     outpath=args.outpath, processes=args.processes,
+                     costtolerance=args.costtolerance, rsstolerance=args.rsstolerance,
+                     curves=args.curves)
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())